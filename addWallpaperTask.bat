@@ -1,2 +1,2 @@
 @echo off
-schtasks /Create /SC HOURLY /TN WallpaperTask /TR "python setWindows10Wallpaper.py"
\ No newline at end of file
+schtasks /Create /SC ONLOGON /TN WallpaperTask /TR "python setWindows10Wallpaper.py --daemon"
\ No newline at end of file
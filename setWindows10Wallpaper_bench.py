@@ -0,0 +1,1107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""    DESCRIPTION
+
+        Micro-benchmarks for setWindows10Wallpaper_cli.py. Every benchmark
+        runs against a throw-away LOCALAPPDATA and TEMP folder, so the real
+        image cache and database are never touched.
+
+    EXAMPLES
+
+        setWindows10Wallpaper_bench.py database
+        setWindows10Wallpaper_bench.py database --rows 10000
+        setWindows10Wallpaper_bench.py maintenance --images 50000
+        setWindows10Wallpaper_bench.py importtime --max-ms 100
+        setWindows10Wallpaper_bench.py prefetch --delay 0.2
+        setWindows10Wallpaper_bench.py async --delay 0.2
+        setWindows10Wallpaper_bench.py download --sizes 1 10 50
+        setWindows10Wallpaper_bench.py resume --size 20
+        setWindows10Wallpaper_bench.py httpcache
+        setWindows10Wallpaper_bench.py spotlight --assets 5000
+        setWindows10Wallpaper_bench.py header --count 10000
+        setWindows10Wallpaper_bench.py probe --files 2000 --latency 0.001
+        setWindows10Wallpaper_bench.py phash --images 100000
+        setWindows10Wallpaper_bench.py random --rows 100000
+        setWindows10Wallpaper_bench.py schema --rows 100000
+        setWindows10Wallpaper_bench.py daemon --assets 2000
+        setWindows10Wallpaper_bench.py queue --delay 0.2
+        setWindows10Wallpaper_bench.py fit --images 20
+        setWindows10Wallpaper_bench.py harvest --months 12
+        setWindows10Wallpaper_bench.py sources --picks 10000
+        setWindows10Wallpaper_bench.py metrics --rows 20000
+
+    EXIT STATUS
+
+        0: command executed successfully
+        2: command failed with errors
+"""
+
+import argparse
+import datetime
+import glob
+import http.server
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import zlib
+
+__author__ = "Roland Rickborn (gitRigge)"
+__copyright__ = "Copyright (C) 2020 Roland Rickborn"
+__license__ = "MIT License (see https://en.wikipedia.org/wiki/MIT_License)"
+
+def use_temporary_folders():
+    """Points LOCALAPPDATA and TEMP to a fresh temporary folder and returns it"""
+
+    base_path = tempfile.mkdtemp(prefix='wariety-bench-')
+    os.environ['LOCALAPPDATA'] = os.path.join(base_path, 'local')
+    os.environ['TEMP'] = os.path.join(base_path, 'temp')
+    os.makedirs(os.environ['LOCALAPPDATA'], exist_ok=True)
+    os.makedirs(os.path.join(os.environ['TEMP'], 'WarietyWallpaperImages'), exist_ok=True)
+    return base_path
+
+def print_result(name, seconds, details=""):
+    """Prints one line of benchmark output"""
+
+    print('{:<40} {:>10.3f} s  {}'.format(name, seconds, details))
+
+def legacy_database_call(db_file, statistics, sql, parameters=()):
+    """Executes 'sql' the way the database helpers did before the shared
+    connection: open, execute, commit and close on every call
+    """
+
+    conn = sqlite3.connect(db_file)
+    statistics['opens'] += 1
+    result = conn.execute(sql, parameters).fetchall()
+    conn.commit()
+    statistics['commits'] += 1
+    conn.close()
+    return result
+
+def generate_image_headers(count):
+    """Returns 'count' image headers of random dimensions, cycling through
+    PNG, GIF, baseline JPEG, progressive JPEG with an EXIF segment, WebP
+    (lossy, lossless, extended) and BMP
+    """
+
+    headers = []
+    for i in range(count):
+        width, height = random.randint(1, 8000), random.randint(1, 8000)
+        kind = i % 8
+        if kind == 0:
+            head = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+        elif kind == 1:
+            head = b'GIF89a' + struct.pack('<HH', width, height) + b'\x00' * 3
+        elif kind == 2:
+            head = generate_jpeg(width, height, 0)
+        elif kind == 3:
+            exif = b'Exif\x00\x00' + b'\x00' * 2000
+            head = b'\xff\xd8\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+            head += b'\xff\xdb' + struct.pack('>H', 67) + b'\x00' * 65
+            head += b'\xff\xc2' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x00' * 9
+        elif kind == 4:
+            head = b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 10 + struct.pack('<HH', width, height)
+        elif kind == 5:
+            bits = (width - 1) | ((height - 1) << 14)
+            head = b'RIFF\x00\x00\x00\x00WEBPVP8L' + b'\x00' * 4 + b'\x2f' + struct.pack('<I', bits)
+        elif kind == 6:
+            head = b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little')
+        else:
+            head = b'BM' + b'\x00' * 12 + struct.pack('<Iii', 40, width, -height)
+        headers.append((head, width, height))
+    return headers
+
+def generate_truncated_image_headers():
+    """Returns short and truncated image files with the result
+    read_image_header() has to return for them: the format and no dimensions
+    """
+
+    jfif = b'\xff\xd8\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    frame = b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, 1080, 1920, 3)
+    return [
+        (b'', (None, None, None)),
+        (b'\xff\xd8', ('jpeg', None, None)),
+        (jfif[:20], ('jpeg', None, None)),
+        (b'\xff\xd8\xff\xe1' + struct.pack('>H', 60000) + b'\x00' * 4994, ('jpeg', None, None)),
+        (b'\xff\xd8\xff\xe1' + struct.pack('>H', 6000) + b'\x00' * 5998 + frame[:6], ('jpeg', None, None)),
+        (b'\x89PNG\r\n\x1a\n\x00\x00', ('png', None, None)),
+        (b'GIF89a\x10', ('gif', None, None)),
+    ]
+
+def generate_jpeg(width, height, size):
+    """Returns 'size' bytes which start like a baseline JPEG image of
+    'width' x 'height' pixels
+    """
+
+    head = b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    head += b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\x00' * 9
+    return head + b'\x00' * max(0, size - len(head) - 2) + b'\xff\xd9'
+
+class MockSourceHandler(http.server.BaseHTTPRequestHandler):
+    """Serves stand-ins for the index pages and images of all remote sources,
+    each answer delayed by the server's 'delay' seconds
+    """
+
+    # Keep-alive, so reused connections can be counted
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.server.requests += 1
+        host = '//{}:{}'.format(*self.server.server_address)
+        path = self.path.split('?')[0]
+        content_type = 'text/html'
+        if path == '/bing':
+            body = json.dumps({'images': [{'url': '/img/bing.jpg&rf=LaDigue_1920x1080.jpg'}]})
+        elif path.startswith('/bingarchive/'):
+            month = path[len('/bingarchive/'):]
+            body = '\n'.join('<img src="{}/img/bingarchive{}_{}.jpg">'.format(host, month, i) for i in range(10))
+        elif path == '/flickr/':
+            body = '<div style="background-image: url({}/img/1234567890_abcdef.jpg)"></div>'.format(host)
+        elif path == '/flickr/1234567890/sizes/h/':
+            body = '<img src="http:{}/img/1234567890_abcdef_h.jpg">'.format(host)
+        elif path == '/natgeo/':
+            body = '"endpoint":"http:{}/gallery.json"\n<meta content="http:{}/img/national.jpg">'.format(host, host)
+        elif path == '/gallery.json':
+            body = json.dumps({'items': [{'image': {'uri': 'http:{}/img/nationalarchive{}.jpg'.format(host, i)}}
+                for i in range(10)]})
+        elif path == '/wiki':
+            body = '<div class="mainpage-potd"><img src="{}/img/500px-wikimedia.jpg"></div>'.format(host)
+        elif path.startswith('/img/'):
+            body = self.server.image
+            content_type = 'image/jpeg'
+        else:
+            self.send_error(404)
+            return
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        status = 200
+        headers = {'Content-Type': content_type}
+        if content_type != 'image/jpeg':
+            headers['ETag'] = '"{:x}"'.format(zlib.crc32(body))
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status = 304
+                body = b''
+        if content_type == 'image/jpeg':
+            headers['ETag'] = '"mock"'
+            headers['Accept-Ranges'] = 'bytes'
+            if self.headers.get('Range') and self.headers.get('If-Range', '"mock"') == '"mock"':
+                first_byte = int(self.headers['Range'][len('bytes='):].split('-')[0])
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(first_byte, len(body) - 1, len(body))
+                body = body[first_byte:]
+                status = 206
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if content_type == 'image/jpeg' and self.server.truncate_after:
+            # Simulates a download interrupted by a timeout
+            body = body[:self.server.truncate_after]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+def start_mock_servers(wariety, delay=0.0, image_size=200000):
+    """Starts one stand-in server per remote source in background threads,
+    so every source has its own host, and points all remote sources of
+    'wariety' to them. Returns the list of servers
+    """
+
+    servers = []
+    for _ in range(5):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockSourceHandler)
+        server.daemon_threads = True
+        server.delay = delay
+        server.requests = 0
+        server.connections = 0
+        server.bytes_sent = 0
+        server.truncate_after = 0
+        server.image = generate_jpeg(1920, 1080, image_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    base_urls = ['http://{}:{}'.format(*server.server_address) for server in servers]
+    wariety.BING_URL = base_urls[0] + '/bing?format=js&idx=0&n=1&mkt=en-US'
+    wariety.BING_ARCHIVE_URL = base_urls[1] + '/bingarchive/{}'
+    wariety.FLICKR_URL = base_urls[2] + '/flickr/'
+    wariety.NATIONAL_GEOGRAPHIC_URL = base_urls[3] + '/natgeo/'
+    wariety.WIKIMEDIA_URL = base_urls[4] + '/wiki'
+    return servers
+
+def reset_mock_servers(servers):
+    """Resets the request and connection counters of 'servers' and returns
+    the previous totals as text
+    """
+
+    requests = sum(server.requests for server in servers)
+    connections = sum(server.connections for server in servers)
+    for server in servers:
+        server.requests = 0
+        server.connections = 0
+    return 'requests={} connections={}'.format(requests, connections)
+
+def stop_mock_servers(servers):
+    """Stops all stand-in servers"""
+
+    for server in servers:
+        server.shutdown()
+
+def benchmark_database(rows):
+    """Compares connect-per-call against the shared connection for 'rows'
+    inserts, lookups, updates and a maintenance style delete pass
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    # Legacy: one connection and one commit per helper call
+    db_file = os.path.join(os.environ['LOCALAPPDATA'], 'legacy.db')
+    statistics = {'opens': 0, 'commits': 0}
+    start = time.perf_counter()
+    legacy_database_call(db_file, statistics, """CREATE TABLE IF NOT EXISTS wallpapers (
+        id integer primary key, iurl text unique, iname text, ipath text, isource text)""")
+    for i in range(rows):
+        url = 'https://example.org/{}.jpg'.format(i)
+        if not legacy_database_call(db_file, statistics, "SELECT id FROM wallpapers WHERE iurl = ?", (url,)):
+            legacy_database_call(db_file, statistics, "INSERT INTO wallpapers (iurl, iname, isource) VALUES (?,?,?)",
+                (url, '{}.jpg'.format(i), 'bench'))
+            legacy_database_call(db_file, statistics, "UPDATE wallpapers SET ipath = ? WHERE iurl = ?",
+                ('/nonexistent/{}.jpg'.format(i), url))
+    for item in legacy_database_call(db_file, statistics, "SELECT ipath FROM wallpapers"):
+        legacy_database_call(db_file, statistics, "DELETE FROM wallpapers WHERE ipath = ?", (item[0],))
+    legacy_seconds = time.perf_counter() - start
+    print_result('database connect-per-call', legacy_seconds,
+        'opens={opens} commits={commits}'.format(**statistics))
+
+    # Shared connection, every helper call committed on its own
+    start = time.perf_counter()
+    wariety.initialization()
+    for i in range(rows):
+        url = 'https://example.org/{}.jpg'.format(i)
+        if not wariety.exists_image_in_database(url):
+            wariety.add_image_to_database(url, '{}.jpg'.format(i), 'bench')
+            wariety.update_image_in_database(url, '/nonexistent/{}.jpg'.format(i))
+    wariety.database_maintenance()
+    shared_seconds = time.perf_counter() - start
+    print_result('database shared connection', shared_seconds,
+        'opens={opens} commits={commits}'.format(**wariety.db_statistics))
+
+    # Shared connection, all inserts batched into one transaction
+    wariety.close_database_connection()
+    os.remove(wariety.get_database_file())
+    wariety.db_statistics.update({'opens': 0, 'commits': 0})
+    start = time.perf_counter()
+    wariety.initialization()
+    with wariety.database_transaction():
+        for i in range(rows):
+            url = 'https://example.org/{}.jpg'.format(i)
+            if not wariety.exists_image_in_database(url):
+                wariety.add_image_to_database(url, '{}.jpg'.format(i), 'bench')
+                wariety.update_image_in_database(url, '/nonexistent/{}.jpg'.format(i))
+    wariety.database_maintenance()
+    batched_seconds = time.perf_counter() - start
+    print_result('database shared connection, batched', batched_seconds,
+        'opens={opens} commits={commits}'.format(**wariety.db_statistics))
+    wariety.close_database_connection()
+    print('speedup shared: {:.1f}x, batched: {:.1f}x'.format(
+        legacy_seconds/shared_seconds, legacy_seconds/batched_seconds))
+
+def benchmark_maintenance(images):
+    """Times database_maintenance() over 'images' cached images of which
+    one in twenty has lost its file and one in twenty is not in the database
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    dir_path = os.path.join(os.environ['TEMP'], 'WarietyWallpaperImages')
+    wariety.initialization()
+    with wariety.database_transaction() as conn:
+        for i in range(images):
+            image_path = os.path.join(dir_path, '{}.jpg'.format(i))
+            if i % 20 != 0:
+                open(image_path, 'wb').close()
+            if i % 20 != 1:
+                conn.execute("INSERT INTO wallpapers (iurl, iname, ipath, isource) VALUES (?,?,?,?)",
+                    ('https://example.org/{}.jpg'.format(i), '{}.jpg'.format(i), image_path, 'bench'))
+    start = time.perf_counter()
+    wariety.database_maintenance()
+    seconds = time.perf_counter() - start
+    with wariety.database_transaction() as conn:
+        remaining_rows = conn.execute("SELECT count(*) FROM wallpapers").fetchone()[0]
+    remaining_files = len(os.listdir(dir_path))
+    wariety.close_database_connection()
+    print_result('maintenance {} images'.format(images), seconds,
+        'rows={} files={}'.format(remaining_rows, remaining_files))
+
+def benchmark_importtime(max_ms, runs):
+    """Measures the import time of setWindows10Wallpaper_cli with
+    'python -X importtime' and the wall time of '--version', lists the
+    slowest imports and fails if the import takes longer than 'max_ms'
+    """
+
+    script_path = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import setWindows10Wallpaper_cli'],
+        cwd=script_path, stderr=subprocess.PIPE, universal_newlines=True)
+    # Lines look like 'import time:       self [us] |   cumulative | imported package'
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    module_us = [cumulative for cumulative, _, name in imports if name.strip() == 'setWindows10Wallpaper_cli']
+    total_us = sum(cumulative for cumulative, _, name in imports if not name.startswith('  '))
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:10]:
+        print('{:>10} us cumulative {:>10} us self  {}'.format(cumulative, self_us, name.strip()))
+    import_ms = (module_us[0] if module_us else total_us) / 1000
+    print_result('import setWindows10Wallpaper_cli', import_ms / 1000, '(all imports {:.1f} ms)'.format(total_us / 1000))
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run([sys.executable, os.path.join(script_path, 'setWindows10Wallpaper_cli.py'), '--version'],
+            stdout=subprocess.DEVNULL, check=True)
+    print_result('setWindows10Wallpaper_cli.py --version', (time.perf_counter() - start) / runs,
+        '(mean of {} runs)'.format(runs))
+
+    if import_ms > max_ms:
+        print('import takes {:.1f} ms, more than {} ms'.format(import_ms, max_ms))
+        sys.exit(2)
+
+def benchmark_prefetch(delay, max_workers):
+    """Prefetches all remote sources from the stand-in servers, which delay
+    every answer by 'delay' seconds, with 1 to 'max_workers' threads
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    for workers in range(1, max_workers + 1):
+        wariety.close_http_session()
+        wariety.close_database_connection()
+        use_temporary_folders()
+        wariety.initialization()
+        reset_mock_servers(servers)
+        start = time.perf_counter()
+        summary = wariety.prefetch_wallpapers(max_workers=workers, timeout=30)
+        seconds = time.perf_counter() - start
+        fetched = len([result for result in summary.values() if result['status'] == 'fetched'])
+        print_result('prefetch {} workers'.format(workers), seconds,
+            'fetched={}/{} {}'.format(fetched, len(summary), reset_mock_servers(servers)))
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+
+def benchmark_async(delay, max_per_host):
+    """Compares calling the synchronous source functions one after another
+    with the asynchronous backend, limited to 1 to 'max_per_host' requests
+    per host, against stand-in servers delaying every answer by 'delay' seconds
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    wariety.initialization()
+    start = time.perf_counter()
+    for source_function in [wariety.get_a_bing_archive_wallpaper_remote, wariety.get_latest_bing_wallpaper_remote,
+        wariety.get_latest_flickr_wallpaper_remote, wariety.get_a_national_geographic_archive_wallpaper_remote,
+        wariety.get_latest_national_geographic_wallpaper_remote, wariety.get_latest_wikimedia_wallpaper_remote]:
+        source_function()
+    print_result('sequential source functions', time.perf_counter() - start,
+        reset_mock_servers(servers))
+    for per_host in range(1, max_per_host + 1):
+        wariety.MAX_REQUESTS_PER_HOST = per_host
+        wariety.close_http_session()
+        wariety.close_database_connection()
+        use_temporary_folders()
+        wariety.initialization()
+        start = time.perf_counter()
+        summary = wariety.prefetch_wallpapers(max_workers=16, timeout=30)
+        fetched = len([result for result in summary.values() if result['status'] == 'fetched'])
+        print_result('async backend, {} per host'.format(per_host), time.perf_counter() - start,
+            'fetched={}/{} {}'.format(fetched, len(summary), reset_mock_servers(servers)))
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+
+def benchmark_download(sizes):
+    """Downloads images of the given 'sizes' in MiB from a stand-in server
+    and reports the time and the peak of memory allocated by Python
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+    wariety.initialization()
+
+    for size in sizes:
+        servers = start_mock_servers(wariety, image_size=size * 1024 * 1024)
+        full_image_url = urllib.parse.urljoin(wariety.BING_URL, '/img/download.jpg')
+        # Imports and session set-up are not part of the download
+        wariety.get_http_session()
+        tracemalloc.start()
+        start = time.perf_counter()
+        full_image_path = wariety.download_image(full_image_url, 'download{}.jpg'.format(size))
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print_result('download {} MiB'.format(size), seconds,
+            'peak={:.0f} KiB file={} bytes'.format(peak / 1024, os.path.getsize(full_image_path)))
+        wariety.close_http_session()
+        stop_mock_servers(servers)
+
+def benchmark_resume(size, interrupt_at):
+    """Downloads an image of 'size' MiB whose first attempt breaks off after
+    'interrupt_at' percent and reports the bytes the second attempt needs
+    with and without support for range requests
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    wariety.initialization()
+    for range_requests in [False, True]:
+        servers = start_mock_servers(wariety, image_size=size * 1024 * 1024)
+        server = servers[0]
+        full_image_url = urllib.parse.urljoin(wariety.BING_URL, '/img/resume.jpg')
+        server.truncate_after = int(len(server.image) * interrupt_at / 100)
+        try:
+            wariety.download_image(full_image_url, 'resume.jpg')
+        except Exception:
+            pass
+        if not range_requests:
+            wariety.delete_partial_download_from_database(full_image_url)
+        server.truncate_after = 0
+        server.bytes_sent = 0
+        start = time.perf_counter()
+        full_image_path = wariety.download_image(full_image_url, 'resume.jpg')
+        seconds = time.perf_counter() - start
+        print_result('second attempt, {}'.format('resumed' if range_requests else 'from zero'), seconds,
+            'transferred={} bytes file={} bytes'.format(server.bytes_sent, os.path.getsize(full_image_path)))
+        os.remove(full_image_path)
+        wariety.close_http_session()
+        stop_mock_servers(servers)
+    wariety.close_database_connection()
+
+def benchmark_httpcache(delay):
+    """Prefetches all remote sources twice from stand-in servers which
+    answer conditional requests and reports the HTTP cache counters
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    wariety.initialization()
+    for run in ['first', 'second']:
+        start = time.perf_counter()
+        wariety.prefetch_wallpapers(timeout=30)
+        seconds = time.perf_counter() - start
+        sent = sum(server.bytes_sent for server in servers)
+        for server in servers:
+            server.bytes_sent = 0
+        print_result('prefetch, {} run'.format(run), seconds,
+            '{} bytes sent={}'.format(reset_mock_servers(servers), sent))
+    statistics = wariety.get_http_cache_statistics()
+    print('http cache: hits={hits} misses={misses} hit rate={hit_rate:.0%} bytes saved={bytes_saved}'.format(**statistics))
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+
+def create_spotlight_assets(wariety, assets):
+    """Creates 'assets' synthetic Spotlight assets: one in ten is no image,
+    all others are portrait JPEGs except the oldest, which is landscape
+    """
+
+    dir_path = wariety.get_spotlight_assets_path()
+    os.makedirs(dir_path, exist_ok=True)
+    portrait = generate_jpeg(1080, 1920, 4096)
+    for i in range(assets):
+        with open(os.path.join(dir_path, '{:064x}'.format(i)), 'wb') as handler:
+            if i == 0:
+                handler.write(generate_jpeg(1920, 1080, 4096))
+            elif i % 10 == 0:
+                handler.write(b'no image' * 512)
+            else:
+                handler.write(portrait)
+        os.utime(os.path.join(dir_path, '{:064x}'.format(i)), (1000000 + i, 1000000 + i))
+    return dir_path
+
+def benchmark_spotlight(assets):
+    """Finds the latest landscape Spotlight asset among 'assets' synthetic
+    assets by probing every file and with the metadata index, cold and warm
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    # No screen is needed to benchmark the scan
+    wariety.is_screen_landscape = lambda: True
+    dir_path = create_spotlight_assets(wariety, assets)
+    wariety.initialization()
+    probes = [0]
+    get_image_metadata = wariety.get_image_metadata
+    def counting_get_image_metadata(asset):
+        probes[0] += 1
+        return get_image_metadata(asset)
+    wariety.get_image_metadata = counting_get_image_metadata
+
+    start = time.perf_counter()
+    for asset in sorted(glob.glob(os.path.join(dir_path, '*')), key=os.path.getmtime, reverse=True):
+        metadata = wariety.get_image_metadata(asset)
+        if metadata['width'] and metadata['width'] > metadata['height']:
+            break
+    print_result('probe every asset', time.perf_counter() - start, 'probes={}'.format(probes[0]))
+
+    for run in ['index cold', 'index warm', 'index warm, 10 changed']:
+        if run == 'index warm, 10 changed':
+            for i in range(1, 11):
+                os.utime(os.path.join(dir_path, '{:064x}'.format(i)), (3000000 + i, 3000000 + i))
+        probes[0] = 0
+        start = time.perf_counter()
+        full_image_path = wariety.get_latest_wallpaper_local()
+        print_result(run, time.perf_counter() - start, 'probes={}'.format(probes[0]))
+        wariety.delete_image_from_database(full_image_path)
+    wariety.close_database_connection()
+
+def benchmark_header(count, rounds):
+    """Parses 'count' generated image headers 'rounds' times and reports the
+    throughput; imghdr detection without dimensions is shown for comparison
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    headers = generate_image_headers(count)
+    # Check the parser before timing it
+    for head, width, height in headers:
+        result = wariety.parse_image_header(head)
+        if result[1:] != (width, height):
+            print('wrong dimensions {} for {}'.format(result, head[:16]))
+            sys.exit(2)
+    # Short and truncated files must end the marker walk, in a thread so a
+    # walk which does not end cannot hang the benchmark
+    for i, (head, expected) in enumerate(generate_truncated_image_headers()):
+        fname = os.path.join(os.environ['TEMP'], 'truncated{}.img'.format(i))
+        with open(fname, 'wb') as fhandle:
+            fhandle.write(head)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(wariety.read_image_header(fname)), daemon=True)
+        thread.start()
+        thread.join(5)
+        if results != [expected]:
+            print('wrong result {} for truncated file {}'.format(results[0] if results else 'none, hangs',
+                head[:16]))
+            sys.exit(2)
+    print('{} truncated files detected'.format(len(generate_truncated_image_headers())))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for head, _, _ in headers:
+            wariety.parse_image_header(head)
+    seconds = time.perf_counter() - start
+    print_result('parse_image_header', seconds, '{:.0f} headers/s'.format(count * rounds / seconds))
+    try:
+        import imghdr
+    except ImportError:
+        return
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for head, _, _ in headers:
+            imghdr.what(None, head)
+    seconds = time.perf_counter() - start
+    print_result('imghdr.what, format only', seconds, '{:.0f} headers/s'.format(count * rounds / seconds))
+
+def benchmark_probe(files, max_workers, latency):
+    """Probes 'files' synthetic images with 1 to 'max_workers' threads. Every
+    header read waits 'latency' seconds, like a read from a network share
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    dir_path = create_spotlight_assets(wariety, files)
+    paths = [os.path.join(dir_path, name) for name in os.listdir(dir_path)]
+    read_image_header = wariety.read_image_header
+    def remote_read_image_header(fname):
+        time.sleep(latency)
+        return read_image_header(fname)
+    wariety.read_image_header = remote_read_image_header
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        start = time.perf_counter()
+        orientations = {}
+        for metadata in wariety.probe_images(iter(paths), max_workers=workers):
+            orientations[metadata['orientation']] = orientations.get(metadata['orientation'], 0) + 1
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print_result('probe {} files, {} workers'.format(files, workers), seconds,
+            'speedup={:.1f}x {}'.format(baseline / seconds, orientations))
+
+def benchmark_phash(images, queries):
+    """Looks up 'queries' perceptual hashes among 'images' random ones with
+    NumPy and, on a tenth of the queries, without it
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    generator = random.Random(0)
+    hashes = [generator.getrandbits(64) - (1 << 63) for _ in range(images)]
+    # Every query is a known hash with three bits flipped
+    query_hashes = [hashes[generator.randrange(images)] ^ (0b111 << generator.randrange(61)) for _ in range(queries)]
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        index = numpy.array(hashes, dtype=numpy.int64)
+        start = time.perf_counter()
+        result = wariety.find_nearest_perceptual_hashes(index, query_hashes)
+        seconds = time.perf_counter() - start
+        print_result('numpy, {} hashes'.format(images), seconds, '{:.0f} queries/s max distance={}'.format(
+            queries / seconds, max(distance for _, distance in result)))
+    sys.modules['numpy'] = None
+    try:
+        start = time.perf_counter()
+        result = wariety.find_nearest_perceptual_hashes(hashes, query_hashes[:max(1, queries // 10)])
+        seconds = time.perf_counter() - start
+    finally:
+        del sys.modules['numpy']
+    print_result('pure Python, {} hashes'.format(images), seconds, '{:.0f} queries/s max distance={}'.format(
+        len(result) / seconds, max(distance for _, distance in result)))
+
+def benchmark_random(rows, picks):
+    """Picks 'picks' random images from a database of 'rows' images with the
+    whole table in memory, like before, and with random ids, and reports
+    time and peak memory allocated by Python per pick
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    wariety.initialization()
+    now = time.time()
+    with wariety.database_transaction() as conn:
+        conn.executemany("""INSERT INTO wallpapers (iurl, iname, ipath, isource, ifetched, ilastshown)
+            VALUES (?,?,?,?,?,?)""", (('https://example.org/{}.jpg'.format(i), '{}.jpg'.format(i),
+            '/nonexistent/{}.jpg'.format(i), random.choice(['bing', 'spotlight', 'wikimedia']),
+            now - i * 3600, now if i % 10 == 0 else None) for i in range(rows)))
+    # Perceptual hashes are not part of the selection
+    wariety.is_near_duplicate = lambda full_image_path, hashes: False
+
+    def pick_from_whole_table():
+        with wariety.database_transaction() as conn:
+            result = conn.execute("SELECT id, ipath FROM wallpapers").fetchall()
+        return result[random.randrange(len(result))][1]
+
+    for name, pick in [('whole table', pick_from_whole_table), ('random ids', wariety.get_random_image_from_database)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(picks):
+            pick()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print_result('{}, {} rows'.format(name, rows), seconds,
+            '{:.2f} ms/pick peak={:.0f} KiB'.format(seconds / picks * 1000, peak / 1024))
+
+def benchmark_schema(rows, deletes):
+    """Upgrades a database of the first release with 'rows' images to the
+    current schema, checks that the query plans of the frequent lookups use
+    an index and times 'deletes' deletes by path before and after
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    conn = sqlite3.connect(wariety.get_database_file())
+    conn.execute("""CREATE TABLE wallpapers (
+        id integer primary key, iurl text unique, iname text, ipath text, isource text)""")
+    conn.executemany("INSERT INTO wallpapers (iurl, iname, ipath, isource) VALUES (?,?,?,?)",
+        (('https://example.org/{}.jpg'.format(i), '{}.jpg'.format(i), '/nonexistent/{}.jpg'.format(i), 'bench')
+        for i in range(rows)))
+    conn.commit()
+    start = time.perf_counter()
+    for i in range(deletes):
+        conn.execute("DELETE FROM wallpapers WHERE ipath = ?", ('/nonexistent/{}.jpg'.format(i),))
+    conn.commit()
+    print_result('{} deletes by path, version 0'.format(deletes), time.perf_counter() - start)
+    conn.close()
+
+    start = time.perf_counter()
+    wariety.initialization()
+    seconds = time.perf_counter() - start
+    with wariety.database_transaction() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    print_result('migration of {} rows'.format(rows), seconds, 'version={}'.format(version))
+    if version != len(wariety.schema_migrations):
+        print('database not migrated to version {}'.format(len(wariety.schema_migrations)))
+        sys.exit(2)
+
+    # Each query of the helpers and the index its plan has to use
+    expected_plans = [
+        ("DELETE FROM wallpapers WHERE ipath = ?", 'wallpapers_ipath'),
+        ("SELECT iphash FROM wallpapers WHERE ipath = ? AND iphash IS NOT NULL", 'wallpapers_ipath'),
+        ("SELECT id FROM wallpapers WHERE isource = ?", 'wallpapers_isource'),
+        ("SELECT ipath FROM wallpapers WHERE ihash = ? AND ipath IS NOT NULL", 'wallpapers_ihash'),
+        ("SELECT ipath FROM wallpapers WHERE iurl = ?", 'sqlite_autoindex_wallpapers_1'),
+        ("SELECT id, ipath FROM wallpapers WHERE id >= ? ORDER BY id LIMIT 1", 'INTEGER PRIMARY KEY'),
+    ]
+    failed = False
+    with wariety.database_transaction() as conn:
+        for query, index in expected_plans:
+            plan = ' '.join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + query, (1,)))
+            if index not in plan:
+                print('no {} in plan of "{}": {}'.format(index, query, plan))
+                failed = True
+    if failed:
+        sys.exit(2)
+    print('query plans use the indexes')
+
+    start = time.perf_counter()
+    with wariety.database_transaction():
+        for i in range(deletes, 2 * deletes):
+            wariety.delete_image_from_database('/nonexistent/{}.jpg'.format(i))
+    print_result('{} deletes by path, version {}'.format(deletes, version), time.perf_counter() - start)
+
+def benchmark_daemon(assets, rotations):
+    """Sets the latest Spotlight image among 'assets' synthetic assets
+    'rotations' times, once with a new process each time, like the hourly
+    scheduled task, and once with the daemon's warm process
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    create_spotlight_assets(wariety, assets)
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'setWindows10Wallpaper_cli.py')
+    start = time.perf_counter()
+    for _ in range(rotations):
+        subprocess.run([sys.executable, script_path, '--setter', 'headless', '--spotlight'], check=True)
+    print_result('new process per wallpaper', (time.perf_counter() - start) / rotations,
+        '(mean of {} runs)'.format(rotations))
+
+    wariety.wallpaper_setter = 'headless'
+    options = dict.fromkeys(wariety.source_options, False)
+    options['spotlight'] = True
+    start = time.perf_counter()
+    done = wariety.run_daemon(argparse.Namespace(**options), 0, rotations=rotations)
+    print_result('daemon, warm process', (time.perf_counter() - start) / done,
+        '(mean of {} rotations)'.format(done))
+    wariety.close_database_connection()
+
+def benchmark_queue(delay, runs):
+    """Measures the time from the start of a --random or --bing run to
+    setting the wallpaper against stand-in servers delaying every answer by
+    'delay' seconds, with an empty queue and 'runs' times with a filled one
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    wariety.initialization()
+    set_times = []
+    wariety.wallpaper_setters['bench'] = lambda path: set_times.append(time.perf_counter())
+    wariety.wallpaper_setter = 'bench'
+    for option in ['bing', 'random']:
+        options = dict.fromkeys(wariety.source_options, False)
+        options[option] = True
+        args = argparse.Namespace(**options)
+        for run in range(runs + 1):
+            start = time.perf_counter()
+            wariety.show_next_wallpaper(args)
+            print_result('--{}, {}'.format(option, 'empty queue' if run == 0 else 'queued'), set_times[-1] - start,
+                '(refill {:.3f} s)'.format(time.perf_counter() - set_times[-1]))
+    print(reset_mock_servers(servers))
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+
+def benchmark_fit(images, max_workers):
+    """Creates screen-fitted copies of 'images' generated 4K JPEGs for two
+    monitors with one process and with 'max_workers' processes, and compares
+    decoding and scaling an original at every set with decoding its copy
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+    try:
+        from PIL import Image
+    except ImportError:
+        print('Pillow is not installed')
+        sys.exit(2)
+
+    wariety.initialization()
+    dir_path = os.path.join(os.environ['TEMP'], 'WarietyWallpaperImages')
+    generator = random.Random(0)
+    for i in range(images):
+        noise = Image.effect_noise((480, 270), 32 + i % 64).resize((3840, 2160), Image.BICUBIC)
+        image = Image.merge('RGB', (noise, Image.linear_gradient('L').resize((3840, 2160)), noise.rotate(180)))
+        full_image_path = os.path.join(dir_path, 'fit{}.jpg'.format(i))
+        image.save(full_image_path, 'JPEG', quality=generator.randint(85, 95))
+        wariety.add_image_to_database('https://example.org/fit{}.jpg'.format(i), 'fit{}.jpg'.format(i), 'bench',
+            full_image_path)
+    original_bytes = sum(os.path.getsize(os.path.join(dir_path, 'fit{}.jpg'.format(i))) for i in range(images))
+    resolutions = [(1920, 1080), (2560, 1440)]
+    for workers in sorted(set([1, max_workers])):
+        shutil.rmtree(wariety.get_fitted_images_folder(), ignore_errors=True)
+        start = time.perf_counter()
+        created = wariety.fit_cached_images(resolutions, max_workers=workers)
+        print_result('fit {} copies, {} processes'.format(created, workers), time.perf_counter() - start)
+    fitted_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(wariety.get_fitted_images_folder(), '*')))
+    print('originals {:.1f} MB, copies {:.1f} MB'.format(original_bytes / wariety.MEGABYTE, fitted_bytes / wariety.MEGABYTE))
+
+    # What the desktop has to do at every set
+    start = time.perf_counter()
+    for i in range(images):
+        with Image.open(os.path.join(dir_path, 'fit{}.jpg'.format(i))) as image:
+            image.convert('RGB').resize(resolutions[0])
+    print_result('decode and scale originals', (time.perf_counter() - start) / images, 'per set')
+    start = time.perf_counter()
+    for i in range(images):
+        fitted_image_path = wariety.get_fitted_image(os.path.join(dir_path, 'fit{}.jpg'.format(i)), resolutions[0])
+        with Image.open(fitted_image_path) as image:
+            image.convert('RGB')
+    print_result('look up and decode copies', (time.perf_counter() - start) / images, 'per set')
+    wariety.close_database_connection()
+
+def benchmark_harvest(months, delay, limit_mb):
+    """Harvests 'months' archive months and the gallery from stand-in
+    servers delaying every answer by 'delay' seconds: first up to a limit of
+    'limit_mb' MB, then the rest, then once more with nothing left to do
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    wariety.initialization()
+    year, month = datetime.date.today().year, datetime.date.today().month
+    for _ in range(months - 1):
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    first_month = '{:04d}{:02d}'.format(year, month)
+    for run, max_bytes in [('limited', int(limit_mb * wariety.MEGABYTE)), ('resumed', 0), ('nothing left', 0)]:
+        budget = wariety.harvest_archives(first_month, max_bytes=max_bytes)
+        print_result('harvest, {}'.format(run), budget['seconds'],
+            'months={} done before={} stored={} bytes={} {}'.format(budget['months'], budget['skipped'],
+            budget['stored'], budget['bytes'], reset_mock_servers(servers)))
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+
+def benchmark_sources(picks, delay):
+    """Shows which sources the dispatcher tries first in 'picks' orders,
+    then lets it fetch from stand-in servers delaying every answer by
+    'delay' seconds until every source is fresh, and checks that a fresh
+    source is served from the cache without a request
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+
+    servers = start_mock_servers(wariety, delay)
+    create_spotlight_assets(wariety, 10)
+    wariety.initialization()
+    source_names = list(wariety.image_sources)
+    first_picks = dict.fromkeys(source_names, 0)
+    for _ in range(picks):
+        first_picks[wariety.get_source_order(source_names)[0]] += 1
+    print('tried first, all stale: ' + ' '.join('{}={:.1%}'.format(name, count / picks)
+        for name, count in sorted(first_picks.items(), key=lambda item: -item[1])))
+
+    failed = False
+    for run in range(len(source_names) + 1):
+        stale_sources = wariety.get_stale_sources(source_names)
+        fetch_times = wariety.get_source_fetch_times()
+        start = time.perf_counter()
+        full_image_path = wariety.get_random_image_from_any_source()
+        seconds = time.perf_counter() - start
+        fetched = [name for name, fetched_at in wariety.get_source_fetch_times().items()
+            if fetched_at != fetch_times.get(name)]
+        if stale_sources and not set(fetched) <= set(stale_sources):
+            failed = True
+        print_result('pick {}, {} stale'.format(run + 1, len(stale_sources)), seconds,
+            'fetched={} image={} {}'.format(','.join(fetched) or '-', bool(full_image_path), reset_mock_servers(servers)))
+
+    start = time.perf_counter()
+    full_image_path = wariety.get_image_from_source('bing')
+    result = reset_mock_servers(servers)
+    print_result('--bing within freshness', time.perf_counter() - start, 'image={} {}'.format(bool(full_image_path), result))
+    if not full_image_path or not result.startswith('requests=0 '):
+        failed = True
+    wariety.close_http_session()
+    wariety.close_database_connection()
+    stop_mock_servers(servers)
+    if failed:
+        print('a fresh source was fetched')
+        sys.exit(2)
+
+def benchmark_metrics(rows, calls):
+    """Compares debug output formatted eagerly with lazy arguments while
+    logging is disabled, for get_all_images_from_database() on 'rows'
+    images, and measures 'calls' timing spans and their report
+    """
+
+    use_temporary_folders()
+    import setWindows10Wallpaper_cli as wariety
+    import logging
+
+    wariety.initialization()
+    with wariety.database_transaction() as conn:
+        conn.executemany("INSERT INTO wallpapers (iurl, iname, ipath, isource) VALUES (?,?,?,?)",
+            [('https://example.org/{}.jpg'.format(i), '{}.jpg'.format(i),
+            os.path.join(os.environ['TEMP'], 'WarietyWallpaperImages', '{}.jpg'.format(i)), 'bench')
+            for i in range(rows)])
+    full_image_paths = wariety.get_all_images_from_database()
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        logging.debug('get_all_images_from_database - full_image_paths = {}'.format(full_image_paths))
+    print_result('eager debug output, logging off', (time.perf_counter() - start) / runs,
+        '({:.1f} us per call, {} paths)'.format((time.perf_counter() - start) / runs * 1000000, rows))
+    start = time.perf_counter()
+    for _ in range(runs):
+        logging.debug('get_all_images_from_database - full_image_paths = %s', full_image_paths)
+    print_result('lazy debug output, logging off', (time.perf_counter() - start) / runs,
+        '({:.1f} us per call, {} paths)'.format((time.perf_counter() - start) / runs * 1000000, rows))
+
+    del wariety.metric_spans[:]
+    start = time.perf_counter()
+    for i in range(calls):
+        with wariety.metric_span('bench', 'source{}'.format(i % 10)) as span:
+            span['bytes'] = i
+    print_result('timing span', (time.perf_counter() - start) / calls,
+        '({:.2f} us per span, {} spans)'.format((time.perf_counter() - start) / calls * 1000000, calls))
+    start = time.perf_counter()
+    wariety.save_metrics()
+    print_result('save spans', time.perf_counter() - start)
+    start = time.perf_counter()
+    metrics = wariety.get_metrics_from_database()
+    print_result('report', time.perf_counter() - start, '({} lines)'.format(len(metrics)))
+    wariety.close_database_connection()
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='Benchmark setWindows10Wallpaper_cli.py.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    database_parser = subparsers.add_parser('database', help="connect-per-call versus shared database connection")
+    database_parser.add_argument('--rows', type=int, default=10000, help="number of rows [default: 10000]")
+    maintenance_parser = subparsers.add_parser('maintenance', help="set-based database maintenance")
+    maintenance_parser.add_argument('--images', type=int, default=50000, help="number of cached images [default: 50000]")
+    importtime_parser = subparsers.add_parser('importtime', help="import time and --version start-up time")
+    importtime_parser.add_argument('--max-ms', type=float, default=100, help="fail above this import time [default: 100]")
+    importtime_parser.add_argument('--runs', type=int, default=10, help="number of --version runs [default: 10]")
+    prefetch_parser = subparsers.add_parser('prefetch', help="concurrent prefetch against a local stand-in server")
+    prefetch_parser.add_argument('--delay', type=float, default=0.2, help="seconds per answer [default: 0.2]")
+    prefetch_parser.add_argument('--workers', type=int, default=6, help="maximum number of threads [default: 6]")
+    async_parser = subparsers.add_parser('async', help="sequential sources versus the asynchronous backend")
+    async_parser.add_argument('--delay', type=float, default=0.2, help="seconds per answer [default: 0.2]")
+    async_parser.add_argument('--per-host', type=int, default=3, help="maximum requests per host [default: 3]")
+    download_parser = subparsers.add_parser('download', help="time and peak memory of image downloads")
+    download_parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50], help="image sizes in MiB [default: 1 10 50]")
+    resume_parser = subparsers.add_parser('resume', help="resumed versus restarted interrupted download")
+    resume_parser.add_argument('--size', type=int, default=20, help="image size in MiB [default: 20]")
+    resume_parser.add_argument('--interrupt-at', type=int, default=70, help="percent of the first attempt [default: 70]")
+    httpcache_parser = subparsers.add_parser('httpcache', help="conditional requests for index pages")
+    httpcache_parser.add_argument('--delay', type=float, default=0.0, help="seconds per answer [default: 0]")
+    spotlight_parser = subparsers.add_parser('spotlight', help="Spotlight scan with and without metadata index")
+    spotlight_parser.add_argument('--assets', type=int, default=5000, help="number of assets [default: 5000]")
+    header_parser = subparsers.add_parser('header', help="throughput of the image header parser")
+    header_parser.add_argument('--count', type=int, default=10000, help="number of generated headers [default: 10000]")
+    header_parser.add_argument('--rounds', type=int, default=10, help="number of rounds [default: 10]")
+    probe_parser = subparsers.add_parser('probe', help="batch probing with 1 to N threads")
+    probe_parser.add_argument('--files', type=int, default=2000, help="number of files [default: 2000]")
+    probe_parser.add_argument('--workers', type=int, default=8, help="maximum number of threads [default: 8]")
+    probe_parser.add_argument('--latency', type=float, default=0.001, help="seconds per header read [default: 0.001]")
+    phash_parser = subparsers.add_parser('phash', help="near-duplicate lookup in the perceptual hash index")
+    phash_parser.add_argument('--images', type=int, default=100000, help="number of indexed images [default: 100000]")
+    phash_parser.add_argument('--queries', type=int, default=1000, help="number of lookups [default: 1000]")
+    random_parser = subparsers.add_parser('random', help="random selection from the whole table versus random ids")
+    random_parser.add_argument('--rows', type=int, default=100000, help="number of images [default: 100000]")
+    random_parser.add_argument('--picks', type=int, default=20, help="number of selections [default: 20]")
+    schema_parser = subparsers.add_parser('schema', help="schema migration and query plans")
+    schema_parser.add_argument('--rows', type=int, default=100000, help="number of images [default: 100000]")
+    schema_parser.add_argument('--deletes', type=int, default=200, help="number of deletes by path [default: 200]")
+    daemon_parser = subparsers.add_parser('daemon', help="new process per wallpaper versus the daemon")
+    daemon_parser.add_argument('--assets', type=int, default=2000, help="number of Spotlight assets [default: 2000]")
+    daemon_parser.add_argument('--rotations', type=int, default=10, help="number of wallpapers [default: 10]")
+    queue_parser = subparsers.add_parser('queue', help="time to set a wallpaper with and without the queue")
+    queue_parser.add_argument('--delay', type=float, default=0.2, help="seconds per answer [default: 0.2]")
+    queue_parser.add_argument('--runs', type=int, default=3, help="number of runs with a filled queue [default: 3]")
+    fit_parser = subparsers.add_parser('fit', help="screen-fitted copies in a process pool")
+    fit_parser.add_argument('--images', type=int, default=20, help="number of 4K images [default: 20]")
+    fit_parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of processes [default: number of CPUs]")
+    harvest_parser = subparsers.add_parser('harvest', help="archive harvest with a byte limit and resume")
+    harvest_parser.add_argument('--months', type=int, default=12, help="number of archive months [default: 12]")
+    harvest_parser.add_argument('--delay', type=float, default=0.05, help="seconds per answer [default: 0.05]")
+    harvest_parser.add_argument('--limit', type=float, default=10, help="MB of the first, limited run [default: 10]")
+    sources_parser = subparsers.add_parser('sources', help="order of the sources and skipping fresh ones")
+    sources_parser.add_argument('--picks', type=int, default=10000, help="number of drawn orders [default: 10000]")
+    sources_parser.add_argument('--delay', type=float, default=0.05, help="seconds per answer [default: 0.05]")
+    metrics_parser = subparsers.add_parser('metrics', help="lazy debug output and cost of the timing spans")
+    metrics_parser.add_argument('--rows', type=int, default=20000, help="number of database rows [default: 20000]")
+    metrics_parser.add_argument('--calls', type=int, default=100000, help="number of timing spans [default: 100000]")
+    args = parser.parse_args()
+    if args.benchmark == 'database':
+        benchmark_database(args.rows)
+    elif args.benchmark == 'maintenance':
+        benchmark_maintenance(args.images)
+    elif args.benchmark == 'importtime':
+        benchmark_importtime(args.max_ms, args.runs)
+    elif args.benchmark == 'prefetch':
+        benchmark_prefetch(args.delay, args.workers)
+    elif args.benchmark == 'async':
+        benchmark_async(args.delay, args.per_host)
+    elif args.benchmark == 'download':
+        benchmark_download(args.sizes)
+    elif args.benchmark == 'resume':
+        benchmark_resume(args.size, args.interrupt_at)
+    elif args.benchmark == 'httpcache':
+        benchmark_httpcache(args.delay)
+    elif args.benchmark == 'spotlight':
+        benchmark_spotlight(args.assets)
+    elif args.benchmark == 'header':
+        benchmark_header(args.count, args.rounds)
+    elif args.benchmark == 'probe':
+        benchmark_probe(args.files, args.workers, args.latency)
+    elif args.benchmark == 'phash':
+        benchmark_phash(args.images, args.queries)
+    elif args.benchmark == 'random':
+        benchmark_random(args.rows, args.picks)
+    elif args.benchmark == 'schema':
+        benchmark_schema(args.rows, args.deletes)
+    elif args.benchmark == 'daemon':
+        benchmark_daemon(args.assets, args.rotations)
+    elif args.benchmark == 'queue':
+        benchmark_queue(args.delay, args.runs)
+    elif args.benchmark == 'fit':
+        benchmark_fit(args.images, args.workers)
+    elif args.benchmark == 'harvest':
+        benchmark_harvest(args.months, args.delay, args.limit)
+    elif args.benchmark == 'sources':
+        benchmark_sources(args.picks, args.delay)
+    elif args.benchmark == 'metrics':
+        benchmark_metrics(args.rows, args.calls)
+    else:
+        parser.print_help()
+        sys.exit(2)
+    sys.exit(0)
@@ -17,6 +17,8 @@
 
         Requires Python 3.*
         Python PyWin32
+        Python Pillow (optional) for perceptual hashes and screen-fitted copies
+        Python NumPy (optional) for fast near-duplicate lookups
 
     EXIT STATUS
 
@@ -25,23 +27,28 @@
 """
 
 import argparse
+import contextlib
 import ctypes
 import datetime
 import glob
-import imghdr
+import hashlib
+import itertools
 import json
 import logging
 import os
 import random
 import re
-import shutil
-import sqlite3
+import sched
 import struct
 import sys
+import threading
+import time
+import urllib.parse
+import weakref
 
-import requests
-import win32api
-import win32con
+# requests, sqlite3, asyncio, concurrent.futures and pywin32 are imported
+# by the functions which need them, so informational options start without
+# loading them
 
 __author__ = "Roland Rickborn (gitRigge)"
 __copyright__ = "Copyright (C) 2020 Roland Rickborn"
@@ -53,6 +60,115 @@ proxies = {
   'http': 'http://0.0.0.0:80/',
   "https": "http://0.0.0.0:8080",
 }
+use_proxy = False
+
+# One HTTP session with pooled keep-alive connections for all requests
+http_session = None
+http_session_lock = threading.Lock()
+# Seconds to wait for the connection and for each answer of a server; they
+# apply to each request, not to all requests of a source together
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 15
+# Retries of failed connections and of answers with status 429 or 5xx
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# Threads which read image headers at the same time, which pays off on
+# network shares where every read waits for the server
+PROBE_WORKERS = 8
+PROBE_CHUNK_SIZE = 32
+# Bytes read at a time to detect format and dimensions of an image
+IMAGE_HEADER_SIZE = 4096
+# Frame header markers of baseline, extended, progressive, lossless and
+# arithmetic coded JPEGs; 0xc4, 0xc8 and 0xcc are other segments
+JPEG_START_OF_FRAME_MARKERS = frozenset([0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+    0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf])
+# Bytes written at a time while downloading an image
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Perceptual hashes differing in at most this many of their 64 bits show
+# the same photo, e.g. in another resolution or a slightly other crop
+NEAR_DUPLICATE_DISTANCE = 10
+# Perceptual hashes of the last wallpapers --random avoids, and the number
+# of random images it tries before it takes a look-alike anyway
+RECENT_WALLPAPERS = 5
+RANDOM_CANDIDATES = 8
+# --random does not show an image again within this many days and prefers
+# recently fetched images, an image fetched this many days ago counts half.
+# The days and the weights of the sources, 1 if not given, can be changed
+# with command line options and are then stored in the database
+RANDOM_REPEAT_DAYS = 7
+RANDOM_RECENCY_HALF_LIFE_DAYS = 90
+# Cost classes of the image sources: reading local files, one request for
+# the index page, several requests one after another
+COST_LOCAL = 0
+COST_ONE_REQUEST = 1
+COST_MULTI_REQUEST = 2
+# Screen size assumed where the Windows System Metrics are not available
+SCREEN_SIZE_WITHOUT_WINDOWS = (1920, 1080)
+# Set once the process has declared itself DPI aware, see set_dpi_awareness()
+dpi_aware = False
+# --daemon sets a new wallpaper every this many minutes and fetches the
+# remote sources this many seconds before
+DAEMON_INTERVAL_MINUTES = 60
+DAEMON_PREFETCH_LEAD = 300
+# Screen-fitted copies of the images: 'fill' scales and crops to the
+# screen, 'fit' scales into the screen, 'off' sets the original images;
+# each can be changed with a command line option and is then stored in the
+# database
+FIT_POLICY = 'fill'
+FIT_QUALITY = 90
+fit_policies = ['fill', 'fit', 'off']
+# Bytes of a KB and a MB in all command line options and reports
+KILOBYTE = 1024
+MEGABYTE = 1024 * KILOBYTE
+# Downloaded images waiting to be set next, per choice of source options
+QUEUE_LENGTH = 3
+# Default limits of the image cache, 0 means no limit; each can be changed
+# with a command line option and is then stored in the database
+CACHE_MAX_BYTES = 1024 * MEGABYTE
+CACHE_MAX_IMAGES = 0
+CACHE_MAX_DAYS = 0
+CACHE_EVICTION_POLICY = 'lru'
+# Order in which images are evicted; the first ones go first. 'lru' evicts
+# the least recently shown, 'lfu' the least often shown images, images
+# never shown count from the time they were fetched
+eviction_policies = {
+    'lru': "MAX(COALESCE(ilastshown, ifetched, 0))",
+    'lfu': "MAX(COALESCE(ishowcount, 0)), MAX(COALESCE(ilastshown, ifetched, 0))",
+}
+# Metrics of scraping, downloads, database access, maintenance and setting
+# the wallpaper are kept for this many days
+METRICS_MAX_DAYS = 30
+
+# Index pages of the remote sources
+BING_URL = "https://www.bing.com/HPImageArchive.aspx?format=js&idx=0&n=1&mkt=en-US"
+BING_ARCHIVE_URL = "https://bingwallpaper.anerg.com/de/{}"
+FLICKR_URL = "https://www.flickr.com/photos/peter-levi/"
+NATIONAL_GEOGRAPHIC_URL = "https://www.nationalgeographic.com/photography/photo-of-the-day/"
+WIKIMEDIA_URL = "https://commons.wikimedia.org/wiki/Hauptseite"
+
+# Requests to one host which may run at the same time, per event loop
+MAX_REQUESTS_PER_HOST = 2
+host_semaphores = weakref.WeakKeyDictionary()
+# Thread pools for the blocking work of an event loop; loops without one
+# use their default executor
+loop_executors = weakref.WeakKeyDictionary()
+
+# Name of the function in wallpaper_setters which sets the wallpaper
+wallpaper_setter = 'windows'
+
+# Keeps image names unique when several downloads start in the same second
+image_name_counter = itertools.count()
+
+# One long-lived database connection shared by all database helpers
+db_connection = None
+db_lock = threading.RLock()
+db_transaction_depth = 0
+db_statistics = {'opens': 0, 'commits': 0}
+
+# Timing spans of this run as (kind, source, ok, seconds, bytes, time),
+# written to the metrics table by save_metrics(); sources are named as in
+# image_sources
+metric_spans = []
 
 def set_proxy_with_environment_variable():
     """Sets HTTP and HTTPS proxies according to environment varialbes, if available"""
@@ -61,15 +177,95 @@ def set_proxy_with_environment_variable():
 
     proxies['http'] = os.getenv('HTTP_PROXY','http://0.0.0.0:80/')
     proxies['https'] = os.getenv('HTTPS_PROXY','http://0.0.0.0:80/')
+    # The shared HTTP session picks up the proxies when it is created
+    close_http_session()
+
+def get_http_session():
+    """Creates the shared HTTP session on first use and returns it. The session
+    keeps up to MAX_REQUESTS_PER_HOST connections per host alive, retries with
+    backoff and uses the proxies if requested
+    """
+
+    global http_session
+
+    with http_session_lock:
+        if http_session is None:
+            logging.debug('get_http_session() - creating session')
+            import requests
+            import requests.adapters
+            import urllib3.util.retry
+            retry = urllib3.util.retry.Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16,
+                pool_maxsize=max(MAX_REQUESTS_PER_HOST, 4), max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if use_proxy:
+                session.proxies.update(proxies)
+                session.verify = False
+            http_session = session
+        return http_session
+
+def fetch_url(url, stream=False, headers=None):
+    """Fetches 'url' with the shared HTTP session and the additional request
+    headers given by 'headers' and returns the response
+    """
+
+    logging.debug('fetch_url(%s, %s)', url, headers)
+
+    return get_http_session().get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), stream=stream,
+        headers=headers)
+
+def close_http_session():
+    """Closes the shared HTTP session and all its connections"""
+
+    global http_session
+
+    with http_session_lock:
+        if http_session is not None:
+            http_session.close()
+            http_session = None
 
 def set_wallpaper_with_ctypes(path):
     """Sets asset given by 'path' as current Desktop wallpaper"""
 
-    logging.debug('set_wallpaper_with_ctypes({})'.format(path))
+    logging.debug('set_wallpaper_with_ctypes(%s)', path)
+
+    import win32con
 
     cs = ctypes.create_string_buffer(path.encode('utf-8'))
     ok = ctypes.windll.user32.SystemParametersInfoA(win32con.SPI_SETDESKWALLPAPER, 0, cs, 0)
 
+def set_wallpaper_headless(path):
+    """Only logs the asset given by 'path'; sets no wallpaper, for runs
+    without a Windows desktop
+    """
+
+    logging.debug('set_wallpaper_headless(%s)', path)
+
+def set_wallpaper(path):
+    """Sets asset given by 'path' as wallpaper with the setter named by
+    'wallpaper_setter'
+    """
+
+    logging.debug('set_wallpaper(%s)', path)
+
+    with metric_span('set', wallpaper_setter):
+        wallpaper_setters[wallpaper_setter](path)
+
+# Functions which set an image as wallpaper by name; '--setter' picks one
+wallpaper_setters = {
+    'windows': set_wallpaper_with_ctypes,
+    'headless': set_wallpaper_headless,
+}
+
+def get_spotlight_assets_path():
+    """Returns the path of the folder where Windows stores the Spotlight assets"""
+
+    return os.path.join(os.environ['LOCALAPPDATA'], 'Packages',
+        'Microsoft.Windows.ContentDeliveryManager_cw5n1h2txyewy', 'LocalState', 'Assets')
+
 def get_latest_wallpaper_local():
     """Loops through all locally stored Windows Spotlight assets
     and copies and returns the latest asset which has the same orientation as the screen
@@ -77,82 +273,260 @@ def get_latest_wallpaper_local():
 
     logging.debug('get_latest_wallpaper_local()')
 
-    list_of_files = sorted(glob.glob(os.environ['LOCALAPPDATA']
-        +r'\Packages\Microsoft.Windows.ContentDeliveryManager_cw5n1h2txyewy\LocalState\Assets'
-        +'\*'), key=os.path.getmtime, reverse=True)
-    for asset in list_of_files:
-        extension = imghdr.what(asset)
+    list_of_files = sorted(scan_image_folder(get_spotlight_assets_path()),
+        key=lambda metadata: metadata['mtime'], reverse=True)
+    screen_landscape = is_screen_landscape()
+    for metadata in list_of_files:
+        asset = metadata['path']
+        extension = metadata['format']
         if extension in ['jpeg', 'jpg', 'png']:
-            if is_image_landscape(asset) == is_screen_landscape():
+            # Calculate Width:Height; > 1 == landscape
+            if metadata['width'] and metadata['height'] and \
+                (metadata['width'] / metadata['height'] > 1) == screen_landscape:
                 # Generate pseudo url
                 full_image_url = os.path.split(asset)[1]
                 if not exists_image_in_database(full_image_url):
                     image_name = get_generated_image_name(asset+'.'+extension)
-                    add_image_to_database(full_image_url, image_name, "spotlight")
                     dir_path = os.path.join(os.environ['TEMP'],'WarietyWallpaperImages')
                     os.makedirs(dir_path, exist_ok=True)
                     full_image_path = os.path.join(dir_path, image_name)
-                    shutil.copyfile(asset, full_image_path)
-                    update_image_in_database(full_image_url, full_image_path)
-                    logging.debug('get_latest_wallpaper_local - full_image_path = {}'.format(full_image_path))
+                    image_hash = copy_image_with_digest(asset, full_image_path)
+                    full_image_path = store_image_blob(full_image_path, image_hash)
+                    add_image_to_database(full_image_url, image_name, "spotlight", full_image_path, image_hash)
+                    logging.debug('get_latest_wallpaper_local - full_image_path = %s', full_image_path)
                     return full_image_path
                 else:
-                    logging.debug('get_latest_wallpaper_local - get_tmage_path_from_database({})'.format(full_image_url))
+                    logging.debug('get_latest_wallpaper_local - get_tmage_path_from_database(%s)', full_image_url)
                     return get_image_path_from_database(full_image_url)
 
+def scan_image_folder(dir_path):
+    """Reads the folder given by 'dir_path' in a single pass and returns a
+    list of dicts with path, size, mtime, format, width and height of every
+    file. Format and dimensions come from the metadata index in the database;
+    only new or changed files are probed, and the index is updated
+    """
+
+    logging.debug('scan_image_folder(%s)', dir_path)
+
+    if not os.path.isdir(dir_path):
+        return []
+    with os.scandir(dir_path) as entries:
+        files = [(entry.path, entry.stat()) for entry in entries if entry.is_file()]
+    indexed = get_image_metadata_from_database(dir_path)
+    all_metadata = []
+    changed_files = {}
+    for path, stat in files:
+        metadata = indexed.pop(path, None)
+        if metadata is None or metadata['size'] != stat.st_size or metadata['mtime'] != stat.st_mtime:
+            changed_files[path] = stat
+        else:
+            all_metadata.append(metadata)
+    probed_metadata = []
+    for metadata in probe_images(changed_files):
+        stat = changed_files[metadata['path']]
+        metadata.update(size=stat.st_size, mtime=stat.st_mtime)
+        probed_metadata.append(metadata)
+    all_metadata.extend(probed_metadata)
+    # Whatever is left in the index has been deleted from the folder
+    if probed_metadata or indexed:
+        with database_transaction():
+            add_image_metadata_to_database(probed_metadata)
+            delete_image_metadata_from_database(list(indexed))
+    logging.debug('scan_image_folder - %s files, %s probed', len(all_metadata), len(probed_metadata))
+    return all_metadata
+
+def get_image_metadata(asset):
+    """Returns a dict with the format, width and height of the asset given
+    by 'asset'. Width and height are 'None' if its format is unknown
+    """
+
+    extension, width, height = read_image_header(asset)
+    return {'format': extension, 'width': width, 'height': height}
+
+def probe_image(path):
+    """Returns a dict with path, size, mtime, format, width, height and
+    orientation ('landscape', 'portrait', 'square' or 'None') of the file
+    given by 'path'. Files which cannot be read have no format
+    """
+
+    try:
+        stat = os.stat(path)
+        metadata = get_image_metadata(path)
+    except OSError:
+        logging.debug('probe_image - cannot read %s', path)
+        return {'path': path, 'size': None, 'mtime': None, 'format': None, 'width': None, 'height': None,
+            'orientation': None}
+    metadata.update(path=path, size=stat.st_size, mtime=stat.st_mtime, orientation=None)
+    if metadata['width'] and metadata['height']:
+        if metadata['width'] > metadata['height']:
+            metadata['orientation'] = 'landscape'
+        elif metadata['width'] < metadata['height']:
+            metadata['orientation'] = 'portrait'
+        else:
+            metadata['orientation'] = 'square'
+    return metadata
+
+def probe_images(paths, max_workers=PROBE_WORKERS, chunk_size=PROBE_CHUNK_SIZE):
+    """Probes the files given by the iterable 'paths' with probe_image() in a
+    pool of 'max_workers' threads, 'chunk_size' files per task, and yields
+    their dicts as soon as a chunk is done, which is not necessarily the order
+    of 'paths'. At most four chunks per thread are queued, so 'paths' may be
+    a lazy iterable of any length
+    """
+
+    logging.debug('probe_images(%s, %s)', max_workers, chunk_size)
+
+    import concurrent.futures
+
+    def probe_chunk(chunk):
+        return [probe_image(path) for path in chunk]
+
+    def chunks():
+        chunk = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for chunk in chunks():
+            pending.add(executor.submit(probe_chunk, chunk))
+            if len(pending) >= max_workers * 4:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield from future.result()
+
 def get_image_size(fname):
-    """Checks if the asset given by 'fname' is of type 'png', 'jpeg' or 'gif',
-    reads the dimensions of the asset and returns its width and height in pixels
+    """Reads the dimensions of the asset given by 'fname' and returns its
+    width and height in pixels or 'None' if it is no png, gif, jpeg, webp
+    or bmp image
     """
     
-    logging.debug('get_image_size({})'.format(fname))
+    logging.debug('get_image_size(%s)', fname)
+
+    extension, width, height = read_image_header(fname)
+    if width is None:
+        logging.debug('get_image_size - unknown image format')
+        return None
+    logging.debug('get_image_size - width, height = %s, %s', width, height)
+    return width, height
+
+def read_image_header(fname):
+    """Reads the beginning of the asset given by 'fname' once and returns
+    its format ('png', 'gif', 'jpeg', 'webp', 'bmp' or 'None'), width and
+    height. Only JPEGs whose frame header lies behind large segments, such
+    as EXIF thumbnails, need further reads
+    """
 
     with open(fname, 'rb') as fhandle:
-        head = fhandle.read(24)
-        if len(head) != 24:
-            return
-        if imghdr.what(fname) == 'png':
-            check = struct.unpack('>i', head[4:8])[0]
-            if check != 0x0d0a1a0a:
-                logging.debug('get_image_size - Stopping application with exit code "2"\n')
-                sys.exit(2)
-            width, height = struct.unpack('>ii', head[16:24])
-        elif imghdr.what(fname) == 'gif':
+        head = fhandle.read(IMAGE_HEADER_SIZE)
+        extension, width, height = parse_image_header(head)
+        if extension != 'jpeg' or width is not None:
+            return extension, width, height
+        # Continue the JPEG marker walk behind the buffer
+        offset = find_jpeg_dimensions(head)[2]
+        while offset is not None:
+            fhandle.seek(offset)
+            head = fhandle.read(IMAGE_HEADER_SIZE)
+            width, height, next_offset = find_jpeg_dimensions(head, 0)
+            if next_offset is not None and (len(head) < 4 or next_offset == 0):
+                # The file ends before the frame header
+                return extension, None, None
+            offset = offset + next_offset if next_offset is not None else None
+        return extension, width, height
+
+def parse_image_header(head):
+    """Detects the format of the image whose first bytes are given by 'head'
+    and returns its format ('png', 'gif', 'jpeg', 'webp', 'bmp' or 'None'),
+    width and height. Width and height are 'None' if the format is unknown or
+    'head' ends before the dimensions
+    """
+
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(head) >= 24 and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return 'png', width, height
+        return 'png', None, None
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        if len(head) >= 10:
             width, height = struct.unpack('<HH', head[6:10])
-        elif imghdr.what(fname) == 'jpeg':
-            try:
-                fhandle.seek(0) # Read 0xff next
-                size = 2
-                ftype = 0
-                while not 0xc0 <= ftype <= 0xcf:
-                    fhandle.seek(size, 1)
-                    byte = fhandle.read(1)
-                    while ord(byte) == 0xff:
-                        byte = fhandle.read(1)
-                    ftype = ord(byte)
-                    size = struct.unpack('>H', fhandle.read(2))[0] - 2
-                # We are at a SOFn block
-                fhandle.seek(1, 1)  # Skip `precision' byte.
-                height, width = struct.unpack('>HH', fhandle.read(4))
-            except Exception: #IGNORE:W0703
-                logging.debug('get_image_size - Stopping application with exit code "2"\n')
-                sys.exit(2)
+            return 'gif', width, height
+        return 'gif', None, None
+    if head[:2] == b'\xff\xd8':
+        width, height, _ = find_jpeg_dimensions(head)
+        return 'jpeg', width, height
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        chunk = head[12:16]
+        if chunk == b'VP8 ' and len(head) >= 30:
+            width, height = struct.unpack('<HH', head[26:30])
+            return 'webp', width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L' and len(head) >= 25:
+            bits = struct.unpack('<I', head[21:25])[0]
+            return 'webp', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X' and len(head) >= 30:
+            width = int.from_bytes(head[24:27], 'little') + 1
+            height = int.from_bytes(head[27:30], 'little') + 1
+            return 'webp', width, height
+        return 'webp', None, None
+    if head[:2] == b'BM' and len(head) >= 26:
+        header_size = struct.unpack('<I', head[14:18])[0]
+        if header_size == 12:
+            # OS/2 bitmap
+            width, height = struct.unpack('<HH', head[18:22])
         else:
-            logging.debug('get_image_size - Stopping application with exit code "2"\n')
-            sys.exit(2)
-        logging.debug('get_image_size - width, height = {}, {}'.format(width, height))
-        return width, height
+            width, height = struct.unpack('<ii', head[18:26])
+        # Negative height means the rows are stored top-down
+        return 'bmp', abs(width), abs(height)
+    return None, None, None
+
+def find_jpeg_dimensions(head, offset=2):
+    """Walks the JPEG markers in 'head' from 'offset' up to the first frame
+    header (SOF0 to SOF15, baseline and progressive) and returns width,
+    height and 'None'. If 'head' ends before, it returns 'None, None' and
+    the offset to continue at; if the data is no valid JPEG, 'None, None, None'
+    """
+
+    while True:
+        if offset + 4 > len(head):
+            return None, None, offset
+        if head[offset] != 0xff:
+            return None, None, None
+        marker = head[offset + 1]
+        if marker == 0xff:
+            # Fill byte
+            offset += 1
+            continue
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            # Markers without length
+            offset += 2
+            continue
+        if marker in JPEG_START_OF_FRAME_MARKERS:
+            if offset + 9 > len(head):
+                return None, None, offset
+            # Length and precision come before height and width
+            height, width = struct.unpack('>HH', head[offset + 5:offset + 9])
+            return width, height, None
+        if marker in (0xd9, 0xda):
+            # End of image or start of scan before any frame header
+            return None, None, None
+        offset += 2 + struct.unpack('>H', head[offset + 2:offset + 4])[0]
 
 def is_image_landscape(asset):
     """Checks the orientation of the asset given by 'asset' and returns 'True' if the asset's
     orientation is landscape
     """
     
-    logging.debug('is_image_landscape({})'.format(asset))
+    logging.debug('is_image_landscape(%s)', asset)
 
     myDim = get_image_size(asset)
     # Calculate Width:Height; > 0 == landscape; < 0 == portrait
-    if myDim[0]/myDim[1] > 1:
+    if myDim and myDim[1] and myDim[0]/myDim[1] > 1:
         logging.debug('is_image_landscape - True')
         return True
     else:
@@ -173,13 +547,40 @@ def is_screen_landscape():
         logging.debug('is_image_landscape - False')
         return False
 
+def set_dpi_awareness():
+    """Declares the process aware of the DPI of every monitor once, so the
+    Windows System Metrics return physical pixels instead of sizes scaled by
+    the display settings
+    """
+
+    global dpi_aware
+
+    if dpi_aware:
+        return
+    dpi_aware = True
+    logging.debug('set_dpi_awareness()')
+    try:
+        # Per monitor DPI aware, since Windows 8.1
+        ctypes.windll.shcore.SetProcessDpiAwareness(2)
+    except (AttributeError, OSError):
+        try:
+            ctypes.windll.user32.SetProcessDPIAware()
+        except (AttributeError, OSError):
+            logging.debug('set_dpi_awareness - not available')
+
 def get_screen_width():
     """Reads Windows System Metrics and returns screen width in pixel"""
 
     logging.debug('get_screen_width()')
 
+    try:
+        import win32api
+    except ImportError:
+        return SCREEN_SIZE_WITHOUT_WINDOWS[0]
+
+    set_dpi_awareness()
     width = win32api.GetSystemMetrics(0)
-    logging.debug('get_screen_width - width = {}'.format(width))
+    logging.debug('get_screen_width - width = %s', width)
     return width
 
 def get_screen_height():
@@ -187,51 +588,360 @@ def get_screen_height():
 
     logging.debug('get_screen_height()')
 
+    try:
+        import win32api
+    except ImportError:
+        return SCREEN_SIZE_WITHOUT_WINDOWS[1]
+
+    set_dpi_awareness()
     height = win32api.GetSystemMetrics(1)
-    logging.debug('get_screen_height - height = {}'.format(height))
+    logging.debug('get_screen_height - height = %s', height)
     return height
 
-def add_image_to_database(full_image_url, image_name, image_source):
-    """Writes full image url given by 'full_image_url' as primary key,
-    image name given by 'image_name' and image source given by 'image_source'
-    to a database"""
+def get_screen_resolutions():
+    """Returns width and height in pixel of every monitor, the primary one
+    first
+    """
+
+    logging.debug('get_screen_resolutions()')
 
-    logging.debug('add_image_to_database({}, {}, {})'.format(full_image_url, image_name, image_source))
+    try:
+        import win32api
+    except ImportError:
+        return [SCREEN_SIZE_WITHOUT_WINDOWS]
+
+    set_dpi_awareness()
+    resolutions = [(get_screen_width(), get_screen_height())]
+    for _, _, (left, top, right, bottom) in win32api.EnumDisplayMonitors():
+        if (right - left, bottom - top) not in resolutions:
+            resolutions.append((right - left, bottom - top))
+    logging.debug('get_screen_resolutions - resolutions = %s', resolutions)
+    return resolutions
+
+def get_database_file():
+    """Creates the folder 'WarietyWallpaperImages' in the local application
+    data location if it does not yet exist and returns the path to the database
+    """
 
     dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
     os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    return os.path.join(dir_path,'wariety.db')
 
-    # Insert a row of data
-    c.execute("""INSERT INTO wallpapers (iurl, iname, isource)
-        VALUES (?,?,?)""", (full_image_url, image_name, image_source))
-    
-    # Save (commit) the changes
-    conn.commit()
+def get_database_connection():
+    """Opens the database once per process in WAL mode and returns the
+    shared connection on every further call
+    """
+
+    global db_connection
+
+    with db_lock:
+        if db_connection is None:
+            logging.debug('get_database_connection() - opening database')
+            import sqlite3
+            # Statements are compiled once and then reused from the statement cache
+            db_connection = sqlite3.connect(get_database_file(), cached_statements=256,
+                check_same_thread=False)
+            db_connection.execute('PRAGMA journal_mode=WAL')
+            db_connection.execute('PRAGMA synchronous=NORMAL')
+            db_statistics['opens'] += 1
+        return db_connection
+
+def close_database_connection():
+    """Commits pending changes and closes the shared database connection"""
+
+    global db_connection
+
+    logging.debug('close_database_connection()')
+
+    with db_lock:
+        if db_connection is not None:
+            if db_connection.in_transaction:
+                db_connection.commit()
+                db_statistics['commits'] += 1
+            db_connection.close()
+            db_connection = None
+
+def add_metric_span(kind, source, ok, seconds, size=0):
+    """Keeps a timing span of 'kind' for 'source' which took 'seconds',
+    transferred 'size' bytes and succeeded if 'ok', until save_metrics()
+    """
+
+    metric_spans.append((kind, source, ok, seconds, size, time.time()))
+
+@contextlib.contextmanager
+def metric_span(kind, source=None):
+    """Times the block as span of 'kind' for 'source'. Yields a dict whose
+    'bytes' the block sets to the bytes it transferred. A block left by an
+    exception counts as failed
+    """
+
+    span = {'bytes': 0}
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield span
+        ok = True
+    finally:
+        add_metric_span(kind, source, ok, time.perf_counter() - start, span['bytes'])
+
+@contextlib.contextmanager
+def database_transaction():
+    """Yields the shared database connection. Nested uses are batched into
+    the outermost transaction, which is committed once at its end or rolled
+    back on error
+    """
 
-    # Close connection
-    conn.close()
+    global db_transaction_depth
+
+    with db_lock:
+        conn = get_database_connection()
+        db_transaction_depth += 1
+        # Only the outermost transaction is timed
+        start = time.perf_counter() if db_transaction_depth == 1 else None
+        try:
+            yield conn
+        except BaseException:
+            db_transaction_depth -= 1
+            if db_transaction_depth == 0 and conn.in_transaction:
+                conn.rollback()
+            if start is not None:
+                add_metric_span('database', None, False, time.perf_counter() - start)
+            raise
+        db_transaction_depth -= 1
+        if db_transaction_depth == 0 and conn.in_transaction:
+            conn.commit()
+            db_statistics['commits'] += 1
+        if start is not None:
+            add_metric_span('database', None, True, time.perf_counter() - start)
+
+def add_image_to_database(full_image_url, image_name, image_source, full_image_path=None, image_hash=None,
+    perceptual_hash=None):
+    """Writes full image url given by 'full_image_url' as primary key,
+    image name given by 'image_name', image source given by 'image_source',
+    full image path given by 'full_image_path', content hash given by
+    'image_hash' and perceptual hash given by 'perceptual_hash' to a database"""
+
+    logging.debug('add_image_to_database(%s, %s, %s, %s, %s, %s)', full_image_url, image_name, image_source, full_image_path, image_hash, perceptual_hash)
+
+    image_size = image_width = image_height = None
+    if full_image_path and os.path.isfile(full_image_path):
+        image_size = os.path.getsize(full_image_path)
+        _, image_width, image_height = read_image_header(full_image_path)
+    with database_transaction() as conn:
+        # Insert a row of data
+        conn.execute("""INSERT INTO wallpapers (iurl, iname, ipath, isource, ihash, iphash, isize, iwidth, iheight, ifetched)
+            VALUES (?,?,?,?,?,?,?,?,?,?)""", (full_image_url, image_name, full_image_path, image_source, image_hash,
+            perceptual_hash, image_size, image_width, image_height, time.time()))
 
 def database_maintenance():
-    """Keep database and image folder synced"""
+    """Keep database and image folder synced. Loads both sides once as sets,
+    deletes database rows whose image is gone in one transaction and removes
+    image files which are not referenced by the database
+    """
 
     logging.debug('database_maintenance()')
 
-    # Check datgabase
-    all_imagepaths = get_all_images_from_database()
-    for imagepath in all_imagepaths:
-        if not os.path.isfile(imagepath):
-            delete_image_from_database(imagepath)
-            logging.debug('database_maintenance() - image not in folder, deleted')
+    dir_path = os.path.normcase(os.path.join(os.environ['TEMP'],'WarietyWallpaperImages'))
+    all_filesystem_paths = set(os.path.normcase(imagepath) for imagepath in get_all_images_from_filesystem())
+    with database_transaction() as conn:
+        rows = conn.execute("SELECT id, ipath FROM wallpapers").fetchall()
+
+        # Check database
+        all_database_paths = set()
+        missing_ids = []
+        for row_id, imagepath in rows:
+            if not imagepath:
+                # Row was added but its download never finished
+                missing_ids.append((row_id,))
+                continue
+            imagepath = os.path.normcase(os.path.abspath(imagepath))
+            all_database_paths.add(imagepath)
+            if imagepath in all_filesystem_paths:
+                continue
+            # Only images outside of the image folder need a separate lookup
+            if os.path.dirname(imagepath) == dir_path or not os.path.isfile(imagepath):
+                missing_ids.append((row_id,))
+        conn.executemany("DELETE FROM wallpapers WHERE id = ?", missing_ids)
+    logging.debug('database_maintenance - %s images not in folder, deleted', len(missing_ids))
+
+    # Check partial downloads
+    with database_transaction() as conn:
+        rows = conn.execute("SELECT iurl, ppath FROM partial_downloads").fetchall()
+        all_partial_paths = set(os.path.normcase(os.path.abspath(imagepath)) for _, imagepath in rows if imagepath)
+        conn.executemany("DELETE FROM partial_downloads WHERE iurl = ?",
+            [(image_url,) for image_url, imagepath in rows if not imagepath or not os.path.isfile(imagepath)])
 
     # Check temporary folder
-    all_imagepaths = get_all_images_from_filesystem()
-    for imagepath in all_imagepaths:
-        if not exists_image_in_database(imagepath):
-            delete_image_from_database(imagepath)
-            logging.debug('database_maintenance() - image not in database, deleted')
+    all_filesystem_paths.update(os.path.normcase(imagepath) for imagepath in glob.glob(os.path.join(dir_path, '*.part')))
+    orphaned_paths = all_filesystem_paths - all_database_paths - all_partial_paths
+    for imagepath in orphaned_paths:
+        try:
+            os.remove(imagepath)
+        except OSError:
+            logging.debug('database_maintenance - could not delete %s', imagepath)
+    logging.debug('database_maintenance - %s images not in database, deleted', len(orphaned_paths))
+
+    # Check screen-fitted copies, named after their image
+    all_image_names = set(os.path.basename(imagepath) for imagepath in all_database_paths)
+    for fitted_image_path in glob.glob(os.path.join(get_fitted_images_folder(), '*')):
+        if os.path.normcase(os.path.basename(fitted_image_path).rsplit('_', 3)[0]) not in all_image_names:
+            try:
+                os.remove(fitted_image_path)
+            except OSError:
+                logging.debug('database_maintenance - could not delete %s', fitted_image_path)
+
+    # Images stored without perceptual hash
+    logging.debug('database_maintenance - %s perceptual hashes computed', update_perceptual_hashes())
+
+def database_maintenance_incremental(max_rows=500, time_budget=0.05):
+    """Keep database and image folder synced step by step. Checks at most
+    'max_rows' database rows or as many as fit into 'time_budget' seconds,
+    starting after the row where the previous run stopped, and deletes the
+    rows whose image is gone. The position is stored in the database and
+    wraps around at the end of the table
+    """
+
+    logging.debug('database_maintenance_incremental(%s, %s)', max_rows, time_budget)
+
+    deadline = time.perf_counter() + time_budget
+    chunk_size = 100
+    checked_rows = 0
+    missing_ids = []
+    with database_transaction() as conn:
+        cursor = int(get_setting_from_database('maintenance_cursor', 0))
+        while checked_rows < max_rows and time.perf_counter() < deadline:
+            limit = min(chunk_size, max_rows - checked_rows)
+            rows = conn.execute("SELECT id, ipath FROM wallpapers WHERE id > ? ORDER BY id LIMIT ?",
+                (cursor, limit)).fetchall()
+            for row_id, imagepath in rows:
+                if not imagepath or not os.path.isfile(imagepath):
+                    missing_ids.append((row_id,))
+                cursor = row_id
+            checked_rows += len(rows)
+            if len(rows) < limit:
+                # End of table reached, start from the beginning next time
+                cursor = 0
+                break
+        conn.executemany("DELETE FROM wallpapers WHERE id = ?", missing_ids)
+        set_setting_in_database('maintenance_cursor', cursor)
+    logging.debug('database_maintenance_incremental - %s rows checked, %s deleted, cursor = %s',
+        checked_rows, len(missing_ids), cursor)
+
+def get_cache_limits():
+    """Returns the limits of the image cache from database: the total bytes,
+    the number of images, the maximum age in days (each 0 for no limit) and
+    the name of the eviction policy
+    """
+
+    logging.debug('get_cache_limits()')
+
+    return (int(get_setting_from_database('cache_max_bytes', CACHE_MAX_BYTES)),
+        int(get_setting_from_database('cache_max_images', CACHE_MAX_IMAGES)),
+        float(get_setting_from_database('cache_max_days', CACHE_MAX_DAYS)),
+        get_setting_from_database('cache_eviction_policy', CACHE_EVICTION_POLICY))
+
+def evict_images(max_bytes, max_images, max_days, policy, keep_paths=(), max_sizes=500):
+    """Deletes cached images with their database rows until at most
+    'max_bytes' bytes and 'max_images' images are left and none was last
+    used more than 'max_days' days ago; 0 means no limit. Images whose age
+    is unknown are only evicted for the size and count limits. The eviction
+    policy given by 'policy' decides which images go first; those given by
+    'keep_paths' are kept. Sizes unknown to the database are looked up for
+    at most 'max_sizes' images per call. Returns the number of deleted images
+    and their bytes
+    """
+
+    logging.debug('evict_images(%s, %s, %s, %s)', max_bytes, max_images, max_days, policy)
+
+    order = eviction_policies[policy]
+    keep_paths = set(os.path.normcase(os.path.abspath(path)) for path in keep_paths)
+    cutoff = time.time() - max_days * 86400 if max_days else 0
+    deleted_images = 0
+    deleted_bytes = 0
+    with database_transaction() as conn:
+        unknown_sizes = conn.execute("""SELECT DISTINCT ipath FROM wallpapers
+            WHERE ipath IS NOT NULL AND isize IS NULL LIMIT ?""", (max_sizes,)).fetchall()
+        sizes = []
+        for (imagepath,) in unknown_sizes:
+            try:
+                sizes.append((os.path.getsize(imagepath), imagepath))
+            except OSError:
+                sizes.append((0, imagepath))
+        conn.executemany("UPDATE wallpapers SET isize = ? WHERE ipath = ?", sizes)
+        # Rows sharing one file count once
+        total_images, total_bytes, oldest = conn.execute("""SELECT COUNT(*), SUM(size), MIN(used) FROM (
+            SELECT MAX(COALESCE(isize, 0)) AS size, MAX(COALESCE(ilastshown, ifetched)) AS used
+            FROM wallpapers WHERE ipath IS NOT NULL GROUP BY ipath)""").fetchone()
+        total_bytes = total_bytes or 0
+        def over_limits(used):
+            return ((max_bytes and total_bytes > max_bytes) or (max_images and total_images > max_images)
+                or (used is not None and used < cutoff))
+        if not over_limits(oldest):
+            return deleted_images, deleted_bytes
+        # Images too old come first, then the order of the policy; images of
+        # unknown age are never too old
+        candidates = conn.execute("""SELECT ipath, MAX(COALESCE(isize, 0)), MAX(COALESCE(ilastshown, ifetched)) AS used
+            FROM wallpapers WHERE ipath IS NOT NULL GROUP BY ipath ORDER BY used < ? DESC, {}""".format(order),
+            (cutoff,)).fetchall()
+        for imagepath, image_size, used in candidates:
+            if not over_limits(used):
+                break
+            if os.path.normcase(os.path.abspath(imagepath)) in keep_paths:
+                continue
+            try:
+                os.remove(imagepath)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logging.debug('evict_images - could not delete %s', imagepath)
+                continue
+            conn.execute("DELETE FROM wallpapers WHERE ipath = ?", (imagepath,))
+            delete_fitted_images(imagepath)
+            total_images -= 1
+            total_bytes -= image_size
+            deleted_images += 1
+            deleted_bytes += image_size
+    logging.debug('evict_images - %s images with %s bytes deleted', deleted_images, deleted_bytes)
+    return deleted_images, deleted_bytes
+
+def record_wallpaper_shown(full_image_path):
+    """Stores the time the image given by 'full_image_path' was set as
+    wallpaper and counts how often it was, for the eviction policies
+    """
+
+    logging.debug('record_wallpaper_shown(%s)', full_image_path)
+
+    with database_transaction() as conn:
+        conn.execute("""UPDATE wallpapers SET ilastshown = ?, ishowcount = COALESCE(ishowcount, 0) + 1
+            WHERE ipath = ?""", (time.time(), full_image_path))
+
+def get_fitted_images_folder():
+    """Returns the path of the folder of the screen-fitted copies, beside
+    the images in the folder 'WarietyWallpaperImages' in the temporary
+    locations
+    """
+
+    return os.path.join(os.environ['TEMP'], 'WarietyWallpaperImages', 'fitted')
+
+def get_fitted_image_path(full_image_path, width, height, policy, quality):
+    """Returns the path of the copy of the image given by 'full_image_path'
+    fitted to 'width' x 'height' pixel with 'policy' and 'quality'
+    """
+
+    return os.path.join(get_fitted_images_folder(), '{}_{}x{}_{}_q{}.jpg'.format(
+        os.path.basename(full_image_path), width, height, policy, quality))
+
+def delete_fitted_images(full_image_path):
+    """Deletes all screen-fitted copies of the image given by 'full_image_path'"""
+
+    logging.debug('delete_fitted_images(%s)', full_image_path)
+
+    pattern = os.path.join(glob.escape(get_fitted_images_folder()), glob.escape(os.path.basename(full_image_path)) + '_*')
+    for fitted_image_path in glob.glob(pattern):
+        try:
+            os.remove(fitted_image_path)
+        except OSError:
+            logging.debug('delete_fitted_images - could not delete %s', fitted_image_path)
 
 def get_all_images_from_filesystem():
     """Reads the folder 'WarietyWallpaperImages' in the temporary
@@ -243,9 +953,13 @@ def get_all_images_from_filesystem():
 
     dir_path = os.path.join(os.environ['TEMP'],'WarietyWallpaperImages')
     all_full_image_paths = []
-    for my_file in os.listdir(dir_path):
-        if os.path.isfile(os.path.join(dir_path, my_file)):
-            all_full_image_paths.append(os.path.join(dir_path, my_file))
+    if not os.path.isdir(dir_path):
+        return all_full_image_paths
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # Partial downloads are no images yet
+            if entry.is_file() and not entry.name.endswith('.part'):
+                all_full_image_paths.append(entry.path)
     return all_full_image_paths
 
 def get_all_images_from_database():
@@ -255,463 +969,1970 @@ def get_all_images_from_database():
 
     logging.debug('get_all_images_from_database()')
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
     full_image_paths = []
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-
-    # Select a row
-    c.execute("SELECT ipath FROM wallpapers", ())
-    result = c.fetchall()
-    conn.close()
+    with database_transaction() as conn:
+        # Select a row
+        result = conn.execute("SELECT ipath FROM wallpapers").fetchall()
     for item in result:
         full_image_paths.append(os.path.abspath(item[0]))
-    logging.debug('get_all_images_from_database - full_image_paths = {}'.format(full_image_paths))
+    logging.debug('get_all_images_from_database - %s full_image_paths', len(full_image_paths))
     return full_image_paths
 
 def delete_image_from_database(full_image_path):
     """Deletes image given by 'full_image_path' from database
     """
 
-    logging.debug('delete_image_from_database({})'.format(full_image_path))
+    logging.debug('delete_image_from_database(%s)', full_image_path)
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-
-    # Select a row
-    c.execute("DELETE FROM wallpapers WHERE ipath = ?", (full_image_path,))
-    conn.commit()
-    conn.close()
+    with database_transaction() as conn:
+        # Delete a row
+        conn.execute("DELETE FROM wallpapers WHERE ipath = ?", (full_image_path,))
 
 def get_image_path_from_database(full_image_url):
     """Reads database and returns full image path based on full image url
     given by 'full_image_url'
     """
 
-    logging.debug('get_image_path_from_database({})'.format(full_image_url))
+    logging.debug('get_image_path_from_database(%s)', full_image_url)
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
     full_image_path = ""
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-
-    # Select a row
-    c.execute("SELECT ipath FROM wallpapers WHERE iurl = ?", (full_image_url,))
-    full_image_path = os.path.abspath(c.fetchone()[0])
-    conn.close()
-    logging.debug('get_image_path_from_database - full_image_path = {}'.format(full_image_path))
+    with database_transaction() as conn:
+        # Select a row
+        row = conn.execute("SELECT ipath FROM wallpapers WHERE iurl = ?", (full_image_url,)).fetchone()
+    full_image_path = os.path.abspath(row[0])
+    logging.debug('get_image_path_from_database - full_image_path = %s', full_image_path)
     return full_image_path
 
 def update_image_in_database(full_image_url, full_image_path):
     """Updates image full path given by 'full_image_path' in database"""
 
-    logging.debug('update_image_in_database({}, {})'.format(full_image_url, full_image_path))
+    logging.debug('update_image_in_database(%s, %s)', full_image_url, full_image_path)
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    with database_transaction() as conn:
+        # Update a row
+        conn.execute("UPDATE wallpapers SET ipath = ? WHERE iurl = ?", (full_image_path, full_image_url))
+
+def get_latest_image_of_source_from_database(image_source):
+    """Reads database and returns the full path of the image fetched last
+    from the source given by 'image_source' if it still exists, else ""
+    """
+
+    logging.debug('get_latest_image_of_source_from_database(%s)', image_source)
 
-    # Update a row
-    c.execute("UPDATE wallpapers SET ipath = ? WHERE iurl = ?", (full_image_path, full_image_url))
+    with database_transaction() as conn:
+        row = conn.execute("""SELECT ipath FROM wallpapers WHERE isource = ? AND ipath IS NOT NULL
+            ORDER BY ifetched DESC LIMIT 1""", (image_source,)).fetchone()
+    if row is None or not os.path.isfile(row[0]):
+        return ""
+    return os.path.abspath(row[0])
+
+def get_image_path_by_hash_from_database(image_hash):
+    """Reads database and returns the full path of an existing image with the
+    content hash given by 'image_hash' or 'None'
+    """
 
-    # Save (commit) the changes
-    conn.commit()
+    logging.debug('get_image_path_by_hash_from_database(%s)', image_hash)
 
-    # Close connection
-    conn.close()
+    with database_transaction() as conn:
+        rows = conn.execute("SELECT ipath FROM wallpapers WHERE ihash = ? AND ipath IS NOT NULL",
+            (image_hash,)).fetchall()
+    for row in rows:
+        if os.path.isfile(row[0]):
+            return os.path.abspath(row[0])
+    return None
 
 def exists_image_in_database(full_image_url):
     """Checks whether an image given by 'full_image_url' exists already in databse"""
 
-    logging.debug('exists_image_in_database({})'.format(full_image_url))
+    logging.debug('exists_image_in_database(%s)', full_image_url)
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    db_file = os.path.join(dir_path,'wariety.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-
-    # Select a row
-    c.execute("SELECT id FROM wallpapers WHERE iurl = ?", (full_image_url,))
+    with database_transaction() as conn:
+        # Select a row
+        row = conn.execute("SELECT id FROM wallpapers WHERE iurl = ?", (full_image_url,)).fetchone()
 
-    if c.fetchone() is not None:
-        conn.close()
+    if row is not None:
         logging.debug('exists_image_in_database - True')
         return True
     else:
-        conn.close()
         logging.debug('exists_image_in_database - False')
         return False
 
-def get_generated_image_name(full_image_url):
-    """Expects URL to an image, retrieves its file extension and returns
-    an image name based on the current date and with the correct file
-    extension
+def get_setting_from_database(key, default=None):
+    """Reads the setting given by 'key' from database and returns its value
+    or 'default' if it is not set
     """
 
-    logging.debug('get_generated_image_name({})'.format(full_image_url))
+    logging.debug('get_setting_from_database(%s)', key)
 
-    image_name = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    image_extension = full_image_url.split(".")[-1]
-    image_name = image_name + "." + image_extension
-    logging.debug('get_generated_image_name - image_name = {}'.format(image_name))
-    return image_name
+    with database_transaction() as conn:
+        row = conn.execute("SELECT svalue FROM settings WHERE skey = ?", (key,)).fetchone()
+    if row is None:
+        return default
+    return row[0]
 
-def download_image(full_image_url, image_name):
-    """Creates the folder 'WarietyWallpaperImages' in the temporary
-    locations if it does not yet exist. Downloads the image given
-    by 'full_image_url', stores it there and returns the path to it
+def set_setting_in_database(key, value):
+    """Writes the setting given by 'key' with the value given by 'value' to database"""
+
+    logging.debug('set_setting_in_database(%s, %s)', key, value)
+
+    with database_transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (skey, svalue) VALUES (?,?)", (key, str(value)))
+
+def add_partial_download_to_database(full_image_url, partial_image_path, offset, validator):
+    """Writes the partial file given by 'partial_image_path' of the image given
+    by 'full_image_url', its size 'offset' and the ETag or Last-Modified header
+    given by 'validator' to database, so the download can be resumed
     """
 
-    logging.debug('download_image({}, {})'.format(full_image_url, image_name))
+    logging.debug('add_partial_download_to_database(%s, %s, %s, %s)', full_image_url, partial_image_path, offset, validator)
 
-    if use_proxy:
-        img_data = requests.get(full_image_url, proxies=proxies, timeout=15, verify=False).content
-    else:
-        img_data = requests.get(full_image_url).content
-    dir_path = os.path.join(os.environ['TEMP'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    with open(os.path.join(dir_path, image_name), 'wb') as handler:
-        handler.write(img_data)
-    image_filesize = os.stat(os.path.join(dir_path, image_name)).st_size
-    logging.debug('download_image - dir_path = {}'.format(dir_path))
-    logging.debug('download_image - image_name = {}'.format(image_name))
-    logging.debug('download_image - image_filesize = {}'.format(image_filesize))
-    return os.path.join(dir_path, image_name)
+    with database_transaction() as conn:
+        conn.execute("""INSERT OR REPLACE INTO partial_downloads (iurl, ppath, poffset, pvalidator)
+            VALUES (?,?,?,?)""", (full_image_url, partial_image_path, offset, validator))
 
-def initialization():
-    """Ensure all tables exist in the database and all keys are available"""
+def get_partial_download_from_database(full_image_url):
+    """Reads database and returns the path of the partial file and the
+    validator of the image given by 'full_image_url' or 'None, None'
+    """
 
-    logging.debug('initialization()')
+    logging.debug('get_partial_download_from_database(%s)', full_image_url)
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    with database_transaction() as conn:
+        row = conn.execute("SELECT ppath, pvalidator FROM partial_downloads WHERE iurl = ?",
+            (full_image_url,)).fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1]
 
-    # Create tables
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS wallpapers (
-        id integer primary key,
-        iurl text unique,
-        iname text,
-        ipath text,
-        isource text)
-        """)
+def delete_partial_download_from_database(full_image_url):
+    """Deletes the partial download of the image given by 'full_image_url' from database"""
 
-    conn.close()
+    logging.debug('delete_partial_download_from_database(%s)', full_image_url)
 
-def get_random_image():
-    """Returns either full image path of a random image from the database or
-    from any of the other image sources
+    with database_transaction() as conn:
+        conn.execute("DELETE FROM partial_downloads WHERE iurl = ?", (full_image_url,))
+
+def add_wallpaper_to_queue_in_database(queue_key, full_image_path):
+    """Appends the image given by 'full_image_path' to the queue of the
+    source options given by 'queue_key' in database
     """
 
-    logging.debug('get_random_image()')
+    logging.debug('add_wallpaper_to_queue_in_database(%s, %s)', queue_key, full_image_path)
 
-    choice = random.randint(1, 10)
-    if choice < 7:
-        return get_random_image_from_any_source()
-    else:
-        return get_random_image_from_database()
-    
-def get_random_image_from_database():
-    """Returns full image path of a random image from the database, if available"""
+    with database_transaction() as conn:
+        conn.execute("INSERT INTO wallpaper_queue (qkey, ipath, qadded) VALUES (?,?,?)",
+            (queue_key, full_image_path, time.time()))
 
-    logging.debug('get_random_image_from_database()')
+def get_wallpaper_queue_from_database(queue_key=None):
+    """Reads database and returns id and path of the images in the queue of
+    the source options given by 'queue_key', of all queues if not given, in
+    queue order
+    """
 
-    dir_path = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
-    os.makedirs(dir_path, exist_ok=True)
-    db_file = os.path.join(dir_path,'wariety.db')
-    full_image_path = ""
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+    logging.debug('get_wallpaper_queue_from_database(%s)', queue_key)
 
-    c.execute("SELECT id, ipath FROM wallpapers")
+    with database_transaction() as conn:
+        if queue_key is None:
+            return conn.execute("SELECT qid, ipath FROM wallpaper_queue ORDER BY qid").fetchall()
+        return conn.execute("SELECT qid, ipath FROM wallpaper_queue WHERE qkey = ? ORDER BY qid",
+            (queue_key,)).fetchall()
 
-    result = c.fetchall()
-    conn.close()
+def delete_wallpaper_from_queue_in_database(queue_id):
+    """Deletes the queue entry given by 'queue_id' from database"""
 
-    max = len(result)
+    logging.debug('delete_wallpaper_from_queue_in_database(%s)', queue_id)
 
-    choice = random.randint(0, int(max+max*.5))
-    try:
-        full_image_path = os.path.abspath(result[choice][1])
-    except:
-        return get_random_image_from_any_source()
-    logging.debug('get_random_image_from_database - full_image_path = {}'.format(full_image_path))
-    return full_image_path
+    with database_transaction() as conn:
+        conn.execute("DELETE FROM wallpaper_queue WHERE qid = ?", (queue_id,))
 
-def get_random_image_from_any_source():
-    """Returns either full image path of a random image from the database"""
+def get_missing_images_from_database(full_image_urls):
+    """Returns the URLs of 'full_image_urls' which are not in the database,
+    in their order and each once, with one query per 500 URLs
+    """
 
-    logging.debug('get_random_image_from_any_source()')
+    logging.debug('get_missing_images_from_database(%s urls)', len(full_image_urls))
 
-    myChoice = random.choice(['bingarchive', 'bing', 'national', 'flickr', 'geographicarchive', 'spotlight', 'wikimedia'])
-    if myChoice == 'bingarchive':
-        logging.debug('get_random_image_from_any_source - get_a_bing_archive_wallpaper_remote()')
-        return get_a_bing_archive_wallpaper_remote()
-    elif myChoice == 'bing':
-        logging.debug('get_random_image_from_any_source - get_latest_bing_wallpaper_remote()')
-        return get_latest_bing_wallpaper_remote()
-    elif myChoice == 'flickr':
-        logging.debug('get_random_image_from_any_source - get_latest_flickr_wallpaper_remote()')
-        return get_latest_flickr_wallpaper_remote()
-    elif myChoice == 'geographicarchive':
-        logging.debug('get_random_image_from_any_source - get_a_national_geographic_archive_wallpaper_remote()')
-        return get_a_national_geographic_archive_wallpaper_remote()
-    elif myChoice == 'national':
-        logging.debug('get_random_image_from_any_source - get_latest_national_geographic_wallpaper_remote()')
-        return get_latest_national_geographic_wallpaper_remote()
-    elif myChoice == 'spotlight':
-        logging.debug('get_random_image_from_any_source - getLatestWallpaperLocal()')
-        return get_latest_wallpaper_local()
-    elif myChoice == 'wikimedia':
-        logging.debug('get_random_image_from_any_source - get_latest_wikimedia_wallpaper_remote()')
-        return get_latest_wikimedia_wallpaper_remote()
+    full_image_urls = list(dict.fromkeys(full_image_urls))
+    known_urls = set()
+    with database_transaction() as conn:
+        for start in range(0, len(full_image_urls), 500):
+            chunk = full_image_urls[start:start + 500]
+            known_urls.update(row[0] for row in conn.execute("SELECT iurl FROM wallpapers WHERE iurl IN ({})".format(
+                ','.join('?' * len(chunk))), chunk))
+    return [full_image_url for full_image_url in full_image_urls if full_image_url not in known_urls]
 
-def get_a_bing_archive_wallpaper_remote():
-    """Retrieves the URL of one image of Bing Wallpaper Archive,
-    downloads the image, stores it in a temporary folder and returns the path
-    to it
+def get_cache_size_from_database():
+    """Reads database and returns the number of cached images and their
+    bytes; rows sharing one file count once
     """
-    
-    logging.debug('get_a_bing_archive_wallpaper_remote()')
 
-    now = datetime.datetime.now()
-    url = "https://bingwallpaper.anerg.com/de/{}".format(now.strftime('%Y%m'))
+    logging.debug('get_cache_size_from_database()')
 
-    # get image url
-    if use_proxy:
-        
-        response = requests.get(url, proxies=proxies, timeout=15, verify=False)
-    else:
-        response = requests.get(url)
-    match = re.findall('.*src=\"([^\"]*\.jpg)\".*', response.text)
-    for i in range(0, len(match)):
-        full_image_url = "https:{}".format(match[i])
-        
-        # image's name
-        image_name = get_generated_image_name(full_image_url)
-        
-        # Check and maintain DB
-        if not exists_image_in_database(full_image_url) and i+1 < len(match):
-            add_image_to_database(full_image_url, image_name, "bingarchive")
-            # download and save image
-            full_image_path = download_image(full_image_url, image_name)
-            update_image_in_database(full_image_url, full_image_path)
-
-            # Return full path to image
-            logging.debug('get_a_bing_archive_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-            return full_image_path
-        elif i+1 == len(match):
-            full_image_path = get_image_path_from_database(full_image_url)
-
-            # Return full path to image
-            logging.debug('get_a_bing_archive_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-            return full_image_path
+    with database_transaction() as conn:
+        images, total_bytes = conn.execute("""SELECT COUNT(*), SUM(size) FROM (
+            SELECT MAX(COALESCE(isize, 0)) AS size FROM wallpapers WHERE ipath IS NOT NULL GROUP BY ipath)""").fetchone()
+    return images, total_bytes or 0
 
-def get_latest_wikimedia_wallpaper_remote():
-    """Retrieves the URL of the latest image of Wikimedia Picture Of The Day,
-    downloads the image, stores it in a temporary folder and returns the path
-    to it
+def add_http_cache_to_database(cache_key, etag, last_modified, result, size):
+    """Writes the validators 'etag' and 'last_modified', the parsed 'result'
+    and the 'size' in bytes of the page given by 'cache_key' to database
     """
 
-    logging.debug('get_latest_wikimedia_wallpaper_remote()')
+    logging.debug('add_http_cache_to_database(%s, %s, %s)', cache_key, etag, last_modified)
 
-    # get image url
-    if use_proxy:
-        response = requests.get("https://commons.wikimedia.org/wiki/Hauptseite", proxies=proxies, timeout=15, verify=False)
-    else:
-        response = requests.get("https://commons.wikimedia.org/wiki/Hauptseite")
-    match = re.search('.*mainpage-potd.*src=\"([^\"]*)\".*', response.text)
-    image_url = match.group(1)
-    full_image_url = image_url.replace('500px','1920px')
+    with database_transaction() as conn:
+        conn.execute("""INSERT OR REPLACE INTO http_cache (ckey, cetag, clastmodified, cresult, csize)
+            VALUES (?,?,?,?,?)""", (cache_key, etag, last_modified, json.dumps(result), size))
 
-    # image's name
-    image_name = get_generated_image_name(full_image_url)
+def get_http_cache_from_database(cache_key):
+    """Reads database and returns a dict with validators, parsed result and
+    size of the page given by 'cache_key' or 'None'
+    """
 
-    # Check and maintain DB
-    if not exists_image_in_database(full_image_url):
-        add_image_to_database(full_image_url, image_name, "wikimedia")
-        # download and save image
-        full_image_path = download_image(full_image_url, image_name)
-        update_image_in_database(full_image_url, full_image_path)
-    else:
-        full_image_path = get_image_path_from_database(full_image_url)
+    logging.debug('get_http_cache_from_database(%s)', cache_key)
 
-    # Return full path to image
-    logging.debug('get_latest_wikimedia_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-    return full_image_path
+    with database_transaction() as conn:
+        row = conn.execute("SELECT cetag, clastmodified, cresult, csize FROM http_cache WHERE ckey = ?",
+            (cache_key,)).fetchone()
+    if row is None:
+        return None
+    return {'etag': row[0], 'last_modified': row[1], 'result': json.loads(row[2]), 'size': row[3]}
 
-def get_latest_flickr_wallpaper_remote():
-    """Retrieves the URL of the latest image of Peter Levi's Flickr Collection,
-    downloads the image, stores it in a temporary folder and returns the path
-    to it
+def update_http_cache_statistics(hits=0, misses=0, bytes_saved=0):
+    """Adds 'hits', 'misses' and 'bytes_saved' to the counters of the HTTP
+    cache in the database
     """
 
-    logging.debug('get_latest_flickr_wallpaper_remote()')
-
-    # get image url
-    if use_proxy:
-        response = requests.get("https://www.flickr.com/photos/peter-levi/", proxies=proxies, timeout=5, verify=False)
-    else:
-        response = requests.get("https://www.flickr.com/photos/peter-levi/")
-    match = re.search('([0-9]{10})_.*\.jpg\)', response.text)
-    image_id = match.group(1)
-    image_url = "https://www.flickr.com/photos/peter-levi/"+image_id+"/sizes/h/"
-    if use_proxy:
-        response = requests.get(image_url, proxies=proxies, timeout=5, verify=False)
-    else:
-        response = requests.get(image_url)
-    pattern = 'http.*'+image_id+'.*_h\.jpg'
-    match = re.search(pattern, response.text)
-    full_image_url = match.group(0)
+    with database_transaction():
+        for key, value in [('http_cache_hits', hits), ('http_cache_misses', misses),
+            ('http_cache_bytes_saved', bytes_saved)]:
+            if value:
+                set_setting_in_database(key, int(get_setting_from_database(key, 0)) + value)
 
-    # image's name
-    image_name = get_generated_image_name(full_image_url)
+def get_http_cache_statistics():
+    """Returns a dict with hits, misses, hit rate and bytes saved of the HTTP cache"""
 
-    # Check and maintain DB
-    if not exists_image_in_database(full_image_url):
-        add_image_to_database(full_image_url, image_name, "flickr")
-        # download and save image
-        full_image_path = download_image(full_image_url, image_name)
-        update_image_in_database(full_image_url, full_image_path)
-    else:
-        full_image_path = get_image_path_from_database(full_image_url)
+    logging.debug('get_http_cache_statistics()')
 
-    # Return full path to image
-    logging.debug('get_latest_flickr_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-    return full_image_path
+    hits = int(get_setting_from_database('http_cache_hits', 0))
+    misses = int(get_setting_from_database('http_cache_misses', 0))
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        'bytes_saved': int(get_setting_from_database('http_cache_bytes_saved', 0))}
 
-def get_a_national_geographic_archive_wallpaper_remote():
-    """Retrieves a URL of National Geographics's Photo Of The Day Archive, downloads the image,
-    stores it in a temporary folder and returns the path to it
+def save_metrics(max_days=METRICS_MAX_DAYS):
+    """Writes the timing spans of this run to database and deletes the ones
+    older than 'max_days' days
     """
 
-    logging.debug('get_a_national_geographic_archive_wallpaper_remote()')
+    logging.debug('save_metrics(%s)', max_days)
 
-    # get image url
-    if use_proxy:
-        response = requests.get("https://www.nationalgeographic.com/photography/photo-of-the-day/", proxies=proxies, timeout=5, verify=False)
-        match = re.search('.*\"endpoint\":\"([^\"]*gallery\.json)\".*', response.text)
-        gallery_json = match.group(1)
-        response = requests.get(gallery_json, proxies=proxies, timeout=5, verify=False)
-    else:
-        response = requests.get("https://www.nationalgeographic.com/photography/photo-of-the-day/")
-        match = re.search('.*\"endpoint\":\"([^\"]*gallery\.json)\".*', response.text)
-        gallery_json = match.group(1)
-        response = requests.get(gallery_json)
-    image_data = json.loads(response.text)
-    for i in range(0, len(image_data["items"])):
-        full_image_url = image_data["items"][i]["image"]["uri"]
-        
-        # image's name
-        image_name = get_generated_image_name(full_image_url)
-        
-        # Check and maintain DB
-        if not exists_image_in_database(full_image_url) and i+1 < len(image_data["items"]):
-            add_image_to_database(full_image_url, image_name, "nationalarchive")
-            # download and save image
-            full_image_path = download_image(full_image_url, image_name)
-            update_image_in_database(full_image_url, full_image_path)
-
-            # Return full path to image
-            logging.debug('get_a_national_geographic_archive_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-            return full_image_path
-        elif i+1 == len(image_data["items"]):
-            full_image_path = get_image_path_from_database(full_image_url)
+    spans = metric_spans[:]
+    del metric_spans[:len(spans)]
+    with database_transaction() as conn:
+        conn.executemany("""INSERT INTO metrics (mkind, msource, mok, mseconds, mbytes, mtime)
+            VALUES (?,?,?,?,?,?)""", spans)
+        conn.execute("DELETE FROM metrics WHERE mtime < ?", (time.time() - max_days * 86400,))
 
-            # Return full path to image
-            logging.debug('get_a_national_geographic_archive_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-            return full_image_path
-    
+def get_metrics_from_database():
+    """Reads database and returns one dict per kind and source of timing
+    span with number of spans, success rate, median and 95th percentile of
+    the seconds and the bytes transferred
+    """
 
-def get_latest_national_geographic_wallpaper_remote():
-    """Retrieves the URL of National Geographics's Photo Of The Day, downloads the image,
-    stores it in a temporary folder and returns the path to it
+    logging.debug('get_metrics_from_database()')
+
+    with database_transaction() as conn:
+        rows = conn.execute("""SELECT mkind, COALESCE(msource, ''), mok, mseconds, mbytes FROM metrics
+            ORDER BY mkind, msource, mseconds""").fetchall()
+    metrics = []
+    for (kind, source), spans in itertools.groupby(rows, key=lambda row: row[:2]):
+        spans = list(spans)
+        seconds = [span[3] for span in spans]
+        metrics.append({'kind': kind, 'source': source, 'count': len(spans),
+            'success': sum(span[2] for span in spans) / len(spans),
+            'p50': seconds[(len(seconds) - 1) // 2], 'p95': seconds[-(-len(seconds) * 95 // 100) - 1],
+            'bytes': sum(span[4] or 0 for span in spans)})
+    return metrics
+
+def print_metrics(metrics, output_format='table'):
+    """Prints one line per kind and source of 'metrics' as table or, for
+    'output_format' 'csv', as comma separated values
     """
 
-    logging.debug('get_latest_national_geographic_wallpaper_remote()')
+    logging.debug('print_metrics(%s)', output_format)
+
+    if output_format == 'csv':
+        import csv
+        writer = csv.DictWriter(sys.stdout, ['kind', 'source', 'count', 'success', 'p50', 'p95', 'bytes'])
+        writer.writeheader()
+        writer.writerows(metrics)
+        return
+    print('{:<12} {:<28} {:>7} {:>8} {:>9} {:>9} {:>10}'.format('kind', 'source', 'count', 'success',
+        'p50', 'p95', 'MB'))
+    for metric in metrics:
+        print('{:<12} {:<28} {:>7} {:>8.1%} {:>7.3f} s {:>7.3f} s {:>10.1f}'.format(metric['kind'], metric['source'],
+            metric['count'], metric['success'], metric['p50'], metric['p95'], metric['bytes'] / MEGABYTE))
+    if not metrics:
+        print('no metrics recorded in the last {} days'.format(METRICS_MAX_DAYS))
+
+def print_http_cache_statistics(statistics):
+    """Prints hits, misses, hit rate and bytes saved of the HTTP cache given
+    by 'statistics'
+    """
 
-    # get image url
-    if use_proxy:
-        response = requests.get("https://www.nationalgeographic.com/photography/photo-of-the-day/", proxies=proxies, timeout=5, verify=False)
-    else:
-        response = requests.get("https://www.nationalgeographic.com/photography/photo-of-the-day/")
-    match = re.search('.*content=\"([^\"]*\.jpg)\".*', response.text)
-    full_image_url = match.group(1)
-    logging.debug('get_latest_national_geographic_wallpaper_remote - full_image_url = {}'.format(full_image_url))
+    logging.debug('print_http_cache_statistics()')
 
-    # image's name
-    image_name = get_generated_image_name(full_image_url)
+    print('HTTP cache: {} hits, {} misses, {:.1%} hit rate, {:.1f} MB saved'.format(statistics['hits'],
+        statistics['misses'], statistics['hit_rate'], statistics['bytes_saved'] / MEGABYTE))
 
-    # Check and maintain DB
-    if not exists_image_in_database(full_image_url):
-        add_image_to_database(full_image_url, image_name, "national")
-        # download and save image
-        full_image_path = download_image(full_image_url, image_name)
-        update_image_in_database(full_image_url, full_image_path)
-    else:
-        full_image_path = get_image_path_from_database(full_image_url)
+def add_image_metadata_to_database(all_metadata):
+    """Writes path, size, mtime, format, width and height of every dict in
+    'all_metadata' to the metadata index in database
+    """
 
-    # Return full path to image
-    logging.debug('get_latest_national_geographic_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-    return full_image_path
+    logging.debug('add_image_metadata_to_database(%s files)', len(all_metadata))
 
-def get_latest_bing_wallpaper_remote():
-    """Retrieves the URL of Bing's Image Of The Day image, downloads the image,
-    stores it in a temporary folder and returns the path to it
+    with database_transaction() as conn:
+        conn.executemany("""INSERT OR REPLACE INTO image_metadata (mpath, msize, mmtime, mformat, mwidth, mheight)
+            VALUES (:path, :size, :mtime, :format, :width, :height)""", all_metadata)
+
+def get_image_metadata_from_database(dir_path):
+    """Reads the metadata index of all files in the folder given by 'dir_path'
+    from database and returns a dict of dicts with path, size, mtime, format,
+    width and height by path
     """
 
-    logging.debug('get_latest_bing_wallpaper_remote()')
+    logging.debug('get_image_metadata_from_database(%s)', dir_path)
 
-    # get image url
-    if use_proxy:
-        response = requests.get("https://www.bing.com/HPImageArchive.aspx?format=js&idx=0&n=1&mkt=en-US", proxies=proxies, timeout=5, verify=False)
-    else:
-        response = requests.get("https://www.bing.com/HPImageArchive.aspx?format=js&idx=0&n=1&mkt=en-US")
-    image_data = json.loads(response.text)
+    # All paths of the folder sort between 'dir_path/' and 'dir_path0'
+    first_path = os.path.join(dir_path, '')
+    last_path = first_path[:-1] + chr(ord(first_path[-1]) + 1)
+    with database_transaction() as conn:
+        rows = conn.execute("""SELECT mpath, msize, mmtime, mformat, mwidth, mheight FROM image_metadata
+            WHERE mpath >= ? AND mpath < ?""", (first_path, last_path)).fetchall()
+    all_metadata = {}
+    for row in rows:
+        # Files of sub folders are not part of the folder
+        if os.path.dirname(row[0]) == os.path.dirname(first_path):
+            all_metadata[row[0]] = {'path': row[0], 'size': row[1], 'mtime': row[2], 'format': row[3],
+                'width': row[4], 'height': row[5]}
+    return all_metadata
 
-    image_url = image_data["images"][0]["url"]
-    image_url = image_url.split("&")[0]
-    full_image_url = "https://www.bing.com" + image_url
-    logging.debug('get_latest_bing_wallpaper_remote - full_image_url = {}'.format(full_image_url))
+def delete_image_metadata_from_database(paths):
+    """Deletes the metadata of all files given by 'paths' from database"""
 
-    # image's name
-    image_name = get_generated_image_name(full_image_url)
+    logging.debug('delete_image_metadata_from_database(%s files)', len(paths))
 
-    # Check and maintain DB
-    if not exists_image_in_database(full_image_url):
-        add_image_to_database(full_image_url, image_name, "bing")
-        # download and save image
-        full_image_path = download_image(full_image_url, image_name)
-        update_image_in_database(full_image_url, full_image_path)
-    else:
-        full_image_path = get_image_path_from_database(full_image_url)
+    with database_transaction() as conn:
+        conn.executemany("DELETE FROM image_metadata WHERE mpath = ?", [(path,) for path in paths])
 
-    # Return full path to image
-    logging.debug('get_latest_bing_wallpaper_remote - full_image_path = {}'.format(full_image_path))
-    return full_image_path
+def get_generated_image_name(full_image_url):
+    """Expects URL to an image, retrieves its file extension and returns
+    an image name based on the current date and with the correct file
+    extension
+    """
 
-def usage(arg):
-    """Shows help of this tool"""
+    logging.debug('get_generated_image_name(%s)', full_image_url)
 
-    logging.debug('usage({})'.format(arg))
+    image_name = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    image_name = image_name + "{:03d}".format(next(image_name_counter) % 1000)
+    image_extension = full_image_url.split(".")[-1]
+    image_name = image_name + "." + image_extension
+    logging.debug('get_generated_image_name - image_name = %s', image_name)
+    return image_name
 
-    myDocstring = ""
-    if arg in ["-i", "--info"]:
-        myDocstring = myDocstring+"\n"+__doc__
-        myDocstring = myDocstring+"\n    AUTHOR\n\n        $author$\n"
-        myDocstring = myDocstring+"\n    LICENSE\n\n        $license$\n"
+def download_image(full_image_url, image_name):
+    """Creates the folder 'WarietyWallpaperImages' in the temporary
+    locations if it does not yet exist. Downloads the image given
+    by 'full_image_url', stores it there and returns the path to it
+    """
+
+    return download_image_with_digest(full_image_url, image_name)[0]
+
+def download_image_with_digest(full_image_url, image_name):
+    """Creates the folder 'WarietyWallpaperImages' in the temporary
+    locations if it does not yet exist. Downloads the image given
+    by 'full_image_url' in chunks to a partial file, checks its size and
+    renames it to 'image_name' there. Returns the path to it and the
+    SHA-256 digest of its content, computed while downloading.
+    An interrupted download keeps its partial file and the next call
+    resumes it with a range request
+    """
+
+    logging.debug('download_image_with_digest(%s, %s)', full_image_url, image_name)
+
+    dir_path = os.path.join(os.environ['TEMP'],'WarietyWallpaperImages')
+    os.makedirs(dir_path, exist_ok=True)
+    full_image_path = os.path.join(dir_path, image_name)
+    partial_image_path, validator = get_partial_download_from_database(full_image_url)
+    if partial_image_path is None or not os.path.isfile(partial_image_path):
+        partial_image_path, validator = full_image_path + '.part', None
+    offset = os.path.getsize(partial_image_path) if os.path.isfile(partial_image_path) else 0
+    headers = {}
+    if offset and validator:
+        # If-Range makes the server send the whole image if it has changed
+        headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+    image_filesize = 0
+    try:
+        with fetch_url(full_image_url, stream=True, headers=headers) as response:
+            if headers and response.status_code == 416:
+                # Range not satisfiable, start over
+                delete_partial_download_from_database(full_image_url)
+                os.remove(partial_image_path)
+                return download_image_with_digest(full_image_url, image_name)
+            response.raise_for_status()
+            content_range = response.headers.get('Content-Range', '')
+            if response.status_code != 206 or not content_range.startswith('bytes {}-'.format(offset)):
+                # The server ignored the range request, fetch the whole image
+                offset = 0
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            # Content-Length counts the encoded bytes if the server compressed the image
+            expected_filesize = response.headers.get('Content-Length')
+            logging.debug('download_image - offset = %s', offset)
+            hasher = hashlib.sha256()
+            if offset:
+                hash_file(partial_image_path, hasher)
+            with open(partial_image_path, 'ab' if offset else 'wb') as handler:
+                try:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        handler.write(chunk)
+                        hasher.update(chunk)
+                        image_filesize += len(chunk)
+                    if expected_filesize is not None and 'Content-Encoding' not in response.headers \
+                        and int(expected_filesize) != image_filesize:
+                        raise IOError('download_image - got {} of {} bytes of {}'.format(
+                            image_filesize, expected_filesize, full_image_url))
+                except BaseException:
+                    if validator:
+                        handler.flush()
+                        add_partial_download_to_database(full_image_url, partial_image_path,
+                            offset + image_filesize, validator)
+                    raise
+        os.replace(partial_image_path, full_image_path)
+        delete_partial_download_from_database(full_image_url)
+    except BaseException:
+        # Keep partial files which can be resumed, drop all others
+        resumable_image_path, _ = get_partial_download_from_database(full_image_url)
+        if resumable_image_path != partial_image_path and os.path.isfile(partial_image_path):
+            os.remove(partial_image_path)
+        raise
+    image_filesize += offset
+    logging.debug('download_image - dir_path = %s', dir_path)
+    logging.debug('download_image - image_name = %s', image_name)
+    logging.debug('download_image - image_filesize = %s', image_filesize)
+    return full_image_path, hasher.hexdigest()
+
+def hash_file(fname, hasher=None):
+    """Feeds the content of the file given by 'fname' to 'hasher', a new
+    SHA-256 hash if not given, and returns the hex digest
+    """
+
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(fname, 'rb') as handler:
+        for chunk in iter(lambda: handler.read(DOWNLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def copy_image_with_digest(source_path, full_image_path):
+    """Copies the file given by 'source_path' through a partial file to
+    'full_image_path' and returns the SHA-256 digest of its content,
+    computed while copying
+    """
+
+    logging.debug('copy_image_with_digest(%s, %s)', source_path, full_image_path)
+
+    hasher = hashlib.sha256()
+    with open(source_path, 'rb') as source, open(full_image_path + '.part', 'wb') as target:
+        for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b''):
+            target.write(chunk)
+            hasher.update(chunk)
+    os.replace(full_image_path + '.part', full_image_path)
+    return hasher.hexdigest()
+
+def store_image_blob(full_image_path, image_hash):
+    """Returns the path of an image already stored with the content hash
+    given by 'image_hash' and deletes the new copy given by 'full_image_path',
+    so equal content is stored once. Returns 'full_image_path' for new content
+    """
+
+    logging.debug('store_image_blob(%s, %s)', full_image_path, image_hash)
+
+    existing_image_path = get_image_path_by_hash_from_database(image_hash)
+    if existing_image_path is None or os.path.normcase(existing_image_path) == os.path.normcase(full_image_path):
+        return full_image_path
+    os.remove(full_image_path)
+    logging.debug('store_image_blob - same content as %s', existing_image_path)
+    return existing_image_path
+
+def deduplicate_images():
+    """Computes the content hash of all images in the database which have
+    none yet, keeps one file per content hash, points all database rows with
+    that hash to it and deletes the other files. Returns the number of
+    deleted files and the bytes reclaimed
+    """
+
+    logging.debug('deduplicate_images()')
+
+    deleted_files = 0
+    reclaimed_bytes = 0
+    with database_transaction() as conn:
+        rows = conn.execute("SELECT id, ipath, ihash FROM wallpapers WHERE ipath IS NOT NULL ORDER BY id").fetchall()
+        canonical_paths = {}
+        for row_id, imagepath, image_hash in rows:
+            if not os.path.isfile(imagepath):
+                continue
+            if image_hash is None:
+                image_hash = hash_file(imagepath)
+                conn.execute("UPDATE wallpapers SET ihash = ? WHERE id = ?", (image_hash, row_id))
+            canonical_path = canonical_paths.setdefault(image_hash, imagepath)
+            if os.path.normcase(canonical_path) == os.path.normcase(imagepath):
+                continue
+            reclaimed_bytes += os.path.getsize(imagepath)
+            os.remove(imagepath)
+            deleted_files += 1
+            # Other rows may still point to the deleted file
+            conn.execute("UPDATE wallpapers SET ipath = ? WHERE ipath = ?", (canonical_path, imagepath))
+    logging.debug('deduplicate_images - %s files deleted, %s bytes reclaimed', deleted_files, reclaimed_bytes)
+    return deleted_files, reclaimed_bytes
+
+def compute_perceptual_hash(fname):
+    """Returns the 64 bit difference hash (dHash) of the image given by
+    'fname' as signed integer, as SQLite stores it. Returns 'None' if the
+    image cannot be decoded or Pillow is not installed
+    """
+
+    logging.debug('compute_perceptual_hash(%s)', fname)
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(fname) as image:
+            # Let the JPEG decoder scale down while decoding
+            image.draft('L', (64, 64))
+            pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logging.debug('compute_perceptual_hash - cannot decode %s', fname)
+        return None
+    perceptual_hash = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            perceptual_hash = (perceptual_hash << 1) | (left > pixels[row * 9 + column + 1])
+    if perceptual_hash >= 1 << 63:
+        perceptual_hash -= 1 << 64
+    return perceptual_hash
+
+def get_perceptual_hash(full_image_path):
+    """Returns the perceptual hash of the image given by 'full_image_path'.
+    It is computed once and stored with all database rows of the image
+    """
+
+    logging.debug('get_perceptual_hash(%s)', full_image_path)
+
+    with database_transaction() as conn:
+        row = conn.execute("SELECT iphash FROM wallpapers WHERE ipath = ? AND iphash IS NOT NULL",
+            (full_image_path,)).fetchone()
+    if row is not None:
+        return row[0]
+    perceptual_hash = compute_perceptual_hash(full_image_path)
+    if perceptual_hash is not None:
+        with database_transaction() as conn:
+            conn.execute("UPDATE wallpapers SET iphash = ? WHERE ipath = ?", (perceptual_hash, full_image_path))
+    return perceptual_hash
+
+def update_perceptual_hashes(max_workers=PROBE_WORKERS):
+    """Computes the perceptual hashes of all images in the database which
+    have none yet in a pool of 'max_workers' threads and returns their number
+    """
+
+    logging.debug('update_perceptual_hashes(%s)', max_workers)
+
+    import concurrent.futures
+    import importlib.util
+
+    if importlib.util.find_spec('PIL') is None:
+        # Without Pillow no image would get a hash
+        return 0
+
+    with database_transaction() as conn:
+        paths = [row[0] for row in conn.execute("""SELECT DISTINCT ipath FROM wallpapers
+            WHERE ipath IS NOT NULL AND iphash IS NULL""")]
+    paths = [path for path in paths if os.path.isfile(path)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = list(executor.map(compute_perceptual_hash, paths))
+    rows = [(perceptual_hash, path) for path, perceptual_hash in zip(paths, hashes) if perceptual_hash is not None]
+    with database_transaction() as conn:
+        conn.executemany("UPDATE wallpapers SET iphash = ? WHERE ipath = ?", rows)
+    return len(rows)
+
+def find_nearest_perceptual_hashes(hashes, query_hashes, chunk_size=64):
+    """Returns for each hash in 'query_hashes' the position of the most
+    similar hash in 'hashes' and the number of bits they differ in, or
+    (-1, 65) if 'hashes' is empty. Both may be lists or NumPy arrays; with
+    NumPy 'chunk_size' queries are compared to all hashes at a time
+    """
+
+    logging.debug('find_nearest_perceptual_hashes(%s, %s)', len(hashes), len(query_hashes))
+
+    if len(hashes) == 0:
+        return [(-1, 65)] * len(query_hashes)
+    try:
+        import numpy
+    except ImportError:
+        result = []
+        for query_hash in query_hashes:
+            distances = [bin((query_hash ^ perceptual_hash) & 0xffffffffffffffff).count('1') for perceptual_hash in hashes]
+            distance = min(distances)
+            result.append((distances.index(distance), distance))
+        return result
+    hashes = numpy.asarray(hashes, dtype=numpy.int64).view(numpy.uint64)
+    query_hashes = numpy.asarray(query_hashes, dtype=numpy.int64).view(numpy.uint64)
+    if hasattr(numpy, 'bitwise_count'):
+        count_bits = numpy.bitwise_count
+    else:
+        # Bits set in each byte value, summed over the eight bytes of a hash
+        bits_per_byte = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.uint8)
+        def count_bits(values):
+            return bits_per_byte[values.view(numpy.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+    result = []
+    for start in range(0, len(query_hashes), chunk_size):
+        chunk = query_hashes[start:start + chunk_size, numpy.newaxis]
+        distances = count_bits(chunk ^ hashes[numpy.newaxis, :])
+        positions = distances.argmin(axis=1)
+        result.extend(zip(positions.tolist(), distances[numpy.arange(len(chunk)), positions].tolist()))
+    return result
+
+def is_near_duplicate(full_image_path, hashes, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """Returns 'True' if the image given by 'full_image_path' differs from
+    one of the perceptual hashes given by 'hashes' in at most 'max_distance'
+    bits. Images without perceptual hash are never near-duplicates
+    """
+
+    logging.debug('is_near_duplicate(%s)', full_image_path)
+
+    perceptual_hash = get_perceptual_hash(full_image_path)
+    if perceptual_hash is None:
+        return False
+    return find_nearest_perceptual_hashes(hashes, [perceptual_hash])[0][1] <= max_distance
+
+def get_recent_perceptual_hashes():
+    """Returns the perceptual hashes of the last wallpapers from database"""
+
+    logging.debug('get_recent_perceptual_hashes()')
+
+    return json.loads(get_setting_from_database('recent_perceptual_hashes', '[]'))
+
+def add_recent_wallpaper(full_image_path):
+    """Remembers the perceptual hash of the wallpaper given by
+    'full_image_path', keeping the last RECENT_WALLPAPERS of them
+    """
+
+    logging.debug('add_recent_wallpaper(%s)', full_image_path)
+
+    perceptual_hash = get_perceptual_hash(full_image_path)
+    if perceptual_hash is None:
+        return
+    recent_hashes = get_recent_perceptual_hashes() + [perceptual_hash]
+    set_setting_in_database('recent_perceptual_hashes', json.dumps(recent_hashes[-RECENT_WALLPAPERS:]))
+
+def initialization():
+    """Ensure all tables exist in the database and all keys are available.
+    Upgrades the schema of an older database step by step, see
+    schema_migrations
+    """
+
+    logging.debug('initialization()')
+
+    with database_transaction() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target_version, migrate in enumerate(schema_migrations[version:], start=version + 1):
+        logging.debug('initialization - migrating database to version %s', target_version)
+        with database_transaction() as conn:
+            # Schema changes and the new version are committed together
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute("PRAGMA user_version = {}".format(target_version))
+
+def add_column_to_database(conn, table, column, column_type):
+    """Adds the column given by 'column' of type 'column_type' to the table
+    given by 'table' unless it exists already
+    """
+
+    logging.debug('add_column_to_database(%s, %s, %s)', table, column, column_type)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info({})".format(table))]
+    if column not in columns:
+        conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, column_type))
+
+def migrate_schema_to_1(conn):
+    """Creates the tables; databases of the first release have the
+    wallpapers table already
+    """
+
+    logging.debug('migrate_schema_to_1()')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS wallpapers (
+        id integer primary key,
+        iurl text unique,
+        iname text,
+        ipath text,
+        isource text)
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+        skey text primary key,
+        svalue text)
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS image_metadata (
+        mpath text primary key,
+        msize integer,
+        mmtime real,
+        mformat text,
+        mwidth integer,
+        mheight integer)
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS http_cache (
+        ckey text primary key,
+        cetag text,
+        clastmodified text,
+        cresult text,
+        csize integer)
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS partial_downloads (
+        iurl text primary key,
+        ppath text,
+        poffset integer,
+        pvalidator text)
+        """)
+
+def migrate_schema_to_2(conn):
+    """Adds content hash, perceptual hash, file size, image dimensions,
+    fetch and show statistics to the wallpapers table
+    """
+
+    logging.debug('migrate_schema_to_2()')
+
+    for column, column_type in [('ihash', 'text'), ('iphash', 'integer'), ('isize', 'integer'),
+        ('iwidth', 'integer'), ('iheight', 'integer'), ('ifetched', 'real'), ('ilastshown', 'real'),
+        ('ishowcount', 'integer')]:
+        add_column_to_database(conn, 'wallpapers', column, column_type)
+
+def migrate_schema_to_3(conn):
+    """Indexes the wallpapers table by path, source and content hash"""
+
+    logging.debug('migrate_schema_to_3()')
+
+    conn.execute("CREATE INDEX IF NOT EXISTS wallpapers_ipath ON wallpapers (ipath)")
+    conn.execute("CREATE INDEX IF NOT EXISTS wallpapers_isource ON wallpapers (isource)")
+    conn.execute("CREATE INDEX IF NOT EXISTS wallpapers_ihash ON wallpapers (ihash)")
+
+def migrate_schema_to_4(conn):
+    """Creates the queue of downloaded images to be set next"""
+
+    logging.debug('migrate_schema_to_4()')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS wallpaper_queue (
+        qid integer primary key,
+        qkey text,
+        ipath text,
+        qadded real)
+        """)
+
+def migrate_schema_to_5(conn):
+    """Creates the table of timing spans and its index by time"""
+
+    logging.debug('migrate_schema_to_5()')
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS metrics (
+        mid integer primary key,
+        mkind text,
+        msource text,
+        mok integer,
+        mseconds real,
+        mbytes integer,
+        mtime real)
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS metrics_mtime ON metrics (mtime)")
+
+def migrate_schema_to_6(conn):
+    """Sets the fetch time of images saved before it was stored to the
+    modification time of their file, so the age limit of the cache does not
+    take them for fetched at the epoch
+    """
+
+    logging.debug('migrate_schema_to_6()')
+
+    rows = conn.execute("SELECT DISTINCT ipath FROM wallpapers WHERE ipath IS NOT NULL AND ifetched IS NULL").fetchall()
+    fetch_times = []
+    for (imagepath,) in rows:
+        try:
+            fetch_times.append((os.path.getmtime(imagepath), imagepath))
+        except OSError:
+            logging.debug('migrate_schema_to_6 - cannot read %s', imagepath)
+    conn.executemany("UPDATE wallpapers SET ifetched = ? WHERE ipath = ? AND ifetched IS NULL", fetch_times)
+
+# Database schema changes in order; PRAGMA user_version is the number of
+# steps done. New steps are appended, existing ones are never changed
+schema_migrations = [migrate_schema_to_1, migrate_schema_to_2, migrate_schema_to_3, migrate_schema_to_4,
+    migrate_schema_to_5, migrate_schema_to_6]
+
+def get_random_image():
+    """Returns either full image path of a random image from the database or
+    from any of the other image sources
+    """
+
+    logging.debug('get_random_image()')
+
+    choice = random.randint(1, 10)
+    # With every source fresh, the cached images are as new as it gets
+    if choice < 7 and get_stale_sources(list(image_sources)):
+        full_image_path = get_random_image_from_any_source()
+        if not full_image_path or not is_near_duplicate(full_image_path, get_recent_perceptual_hashes()):
+            return full_image_path
+        logging.debug('get_random_image - %s looks like a recent wallpaper', full_image_path)
+    return get_random_image_from_database()
+    
+def get_random_image_from_database():
+    """Returns full image path of a random image from the database, if available"""
+
+    logging.debug('get_random_image_from_database()')
+
+    full_image_path = ""
+    candidates = get_random_images_from_database(RANDOM_CANDIDATES)
+    if not candidates:
+        # Every image was shown lately, take one of them
+        candidates = get_random_images_from_database(RANDOM_CANDIDATES, repeat_days=0)
+    if not candidates:
+        return get_random_image_from_any_source()
+
+    # Draw by weight, skipping images looking like one of the last wallpapers
+    recent_hashes = get_recent_perceptual_hashes()
+    source_weights = get_random_settings()[1]
+    weights = [get_random_image_weight(image_source, fetched, source_weights) for _, image_source, fetched in candidates]
+    while candidates:
+        choice = random.choices(range(len(candidates)), weights if any(weights) else None)[0]
+        full_image_path = os.path.abspath(candidates.pop(choice)[0])
+        del weights[choice]
+        if not is_near_duplicate(full_image_path, recent_hashes):
+            break
+    logging.debug('get_random_image_from_database - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_random_settings():
+    """Returns the days in which --random does not show an image again and
+    the dict of weights by source name from database
+    """
+
+    logging.debug('get_random_settings()')
+
+    return (float(get_setting_from_database('random_repeat_days', RANDOM_REPEAT_DAYS)),
+        json.loads(get_setting_from_database('random_source_weights', '{}')))
+
+def parse_source_weight(text):
+    """Checks a weight given by '--random-weight' as 'SOURCE=WEIGHT' and
+    returns the name of the source in the database and the weight
+    """
+
+    source_name, _, weight = text.partition('=')
+    try:
+        weight = float(weight)
+        if source_name not in image_sources or weight < 0:
+            raise ValueError(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected SOURCE=WEIGHT with SOURCE one of {} and WEIGHT 0 or more, got '{}'".format(
+            ', '.join(image_sources), text))
+    return image_sources[source_name]['source'], weight
+
+def get_random_images_from_database(count, repeat_days=None):
+    """Returns path, source and fetch time of up to 'count' random images
+    from the database which were not shown within 'repeat_days' days, the
+    stored setting if not given. Each one is found through a random id, so
+    neither time nor memory grow with the table; an image after a gap in the
+    ids is found a bit more often
+    """
+
+    logging.debug('get_random_images_from_database(%s, %s)', count, repeat_days)
+
+    if repeat_days is None:
+        repeat_days = get_random_settings()[0]
+    shown_before = time.time() - repeat_days * 86400
+    candidates = {}
+    with database_transaction() as conn:
+        max_id = conn.execute("SELECT MAX(id) FROM wallpapers").fetchone()[0]
+        if max_id is None:
+            return []
+        for _ in range(count):
+            start_id = random.randint(1, max_id)
+            # The first matching image at or after the random id, else the first one at all
+            for query in ("WHERE id >= ? AND", "WHERE ? > 0 AND"):
+                row = conn.execute("""SELECT id, ipath, isource, ifetched FROM wallpapers {}
+                    ipath IS NOT NULL AND (ilastshown IS NULL OR ilastshown < ?) ORDER BY id LIMIT 1""".format(query),
+                    (start_id, shown_before)).fetchone()
+                if row is not None:
+                    candidates[row[0]] = row[1:]
+                    break
+            else:
+                break
+    return list(candidates.values())
+
+def get_random_image_weight(image_source, fetched, source_weights=None):
+    """Returns the weight of an image from the source given by 'image_source'
+    and fetched at the time given by 'fetched' for the random selection.
+    'source_weights' are the weights by source name, the stored setting if
+    not given
+    """
+
+    logging.debug('get_random_image_weight(%s, %s)', image_source, fetched)
+
+    if source_weights is None:
+        source_weights = get_random_settings()[1]
+    age_days = 0
+    if fetched is not None:
+        age_days = max(0, time.time() - fetched) / 86400
+    return source_weights.get(image_source, 1) * 0.5 ** (age_days / RANDOM_RECENCY_HALF_LIFE_DAYS)
+
+def get_random_image_from_any_source():
+    """Returns full image path of an image from a random source. Sources
+    not fetched within their freshness period are tried first, cheaper and
+    faster ones more likely; a failing source is skipped
+    """
+
+    logging.debug('get_random_image_from_any_source()')
+
+    for source_name in get_source_order(list(image_sources)):
+        try:
+            full_image_path = get_image_from_source(source_name)
+        except Exception:
+            logging.debug('get_random_image_from_any_source - %s failed', source_name, exc_info=True)
+            continue
+        if full_image_path:
+            return full_image_path
+    return ""
+
+def get_host_semaphore(url):
+    """Returns the semaphore of the running event loop which limits the
+    requests to the host of 'url' to MAX_REQUESTS_PER_HOST at a time
+    """
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    semaphores = host_semaphores.setdefault(loop, {})
+    host = urllib.parse.urlsplit(url).netloc
+    if host not in semaphores:
+        semaphores[host] = asyncio.Semaphore(MAX_REQUESTS_PER_HOST)
+    return semaphores[host]
+
+async def run_blocking_async(function, *args):
+    """Runs 'function(*args)' in the thread pool of the running event loop
+    without blocking it and returns the result
+    """
+
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(loop_executors.get(loop), function, *args)
+
+async def fetch_parsed_async(url, parse, source_name):
+    """Fetches 'url' for the source given by 'source_name' without blocking
+    the event loop and returns the list 'parse(url, text)' returns for it.
+    The request is timed as scrape of the source and conditional: if the
+    server answers '304 Not Modified', the list parsed last time is returned
+    from the HTTP cache without parsing. Requests to different hosts overlap,
+    requests to the same host are limited by get_host_semaphore()
+    """
+
+    logging.debug('fetch_parsed_async(%s, %s, %s)', url, parse.__name__, source_name)
+
+    # The same page may be parsed for different things
+    cache_key = '{} {}'.format(parse.__name__, url)
+    cached = get_http_cache_from_database(cache_key)
+    headers = {}
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    with metric_span('scrape', source_name) as span:
+        async with get_host_semaphore(url):
+            response = await run_blocking_async(fetch_url, url, False, headers)
+        if response.status_code == 304 and cached is not None:
+            logging.debug('fetch_parsed_async - not modified')
+            update_http_cache_statistics(hits=1, bytes_saved=cached['size'])
+            return cached['result']
+        response.raise_for_status()
+        span['bytes'] = len(response.content)
+        result = parse(url, response.text)
+    update_http_cache_statistics(misses=1)
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        add_http_cache_to_database(cache_key, etag, last_modified, result, len(response.content))
+    return result
+
+async def store_a_remote_image_async(full_image_urls, image_source):
+    """Runs store_a_remote_image() without blocking the event loop, limited
+    like the other requests to the host of the images
+    """
+
+    logging.debug('store_a_remote_image_async(%s, %s)', full_image_urls, image_source)
+
+    async with get_host_semaphore(full_image_urls[0]):
+        return await run_blocking_async(store_a_remote_image, full_image_urls, image_source)
+
+def run_async(coroutine):
+    """Runs 'coroutine' on a new event loop and returns its result, so the
+    synchronous source functions can use the asynchronous fetch backend
+    """
+
+    import asyncio
+
+    return asyncio.run(coroutine)
+
+def store_remote_image(full_image_url, image_source):
+    """Downloads the image given by 'full_image_url' from the source given
+    by 'image_source' unless it is already in the database and returns the
+    full path to it. A cached image with the same content is used instead
+    of the download
+    """
+
+    logging.debug('store_remote_image(%s, %s)', full_image_url, image_source)
+
+    # image's name
+    image_name = get_generated_image_name(full_image_url)
+
+    # Check and maintain DB
+    if not exists_image_in_database(full_image_url):
+        # download and save image, the database only learns about complete images
+        with metric_span('download', get_source_name(image_source)) as span:
+            full_image_path, image_hash = download_image_with_digest(full_image_url, image_name)
+            span['bytes'] = os.path.getsize(full_image_path)
+        full_image_path = store_image_blob(full_image_path, image_hash)
+        # Stored for --random, which avoids look-alikes of recent wallpapers
+        add_image_to_database(full_image_url, image_name, image_source, full_image_path, image_hash,
+            compute_perceptual_hash(full_image_path))
+    else:
+        full_image_path = get_image_path_from_database(full_image_url)
+    return full_image_path
+
+def store_a_remote_image(full_image_urls, image_source):
+    """Stores the first image of 'full_image_urls' which is not yet in the
+    database and returns the full path to it. If all images are known, the
+    path of the last one is returned
+    """
+
+    logging.debug('store_a_remote_image(%s, %s)', full_image_urls, image_source)
+
+    for full_image_url in full_image_urls[:-1]:
+        if not exists_image_in_database(full_image_url):
+            return store_remote_image(full_image_url, image_source)
+    return store_remote_image(full_image_urls[-1], image_source)
+
+def parse_bing_archive_page(url, text):
+    """Returns the URLs of all images on the Bing Wallpaper Archive page
+    given by 'url' and 'text'
+    """
+
+    match = re.findall(r'.*src="([^"]*\.jpg)".*', text)
+    return [urllib.parse.urljoin(url, image_url) for image_url in match]
+
+def parse_wikimedia_page(url, text):
+    """Returns the URL of the Wikimedia Picture Of The Day on the page
+    given by 'url' and 'text'
+    """
+
+    match = re.search(r'.*mainpage-potd.*src="([^"]*)".*', text)
+    image_url = match.group(1)
+    return [urllib.parse.urljoin(url, image_url.replace('500px','1920px'))]
+
+def parse_flickr_photostream(url, text):
+    """Returns the id of the latest photo on the Flickr photostream page
+    given by 'url' and 'text'
+    """
+
+    match = re.search(r'([0-9]{10})_.*\.jpg\)', text)
+    return [match.group(1)]
+
+def parse_flickr_sizes_page(url, text):
+    """Returns the URL of the large image on the Flickr sizes page given by
+    'url' and 'text'
+    """
+
+    # url is '.../<image id>/sizes/h/'
+    image_id = url.split('/')[-4]
+    pattern = 'http.*'+image_id+r'.*_h\.jpg'
+    match = re.search(pattern, text)
+    return [match.group(0)]
+
+def parse_national_geographic_endpoint(url, text):
+    """Returns the URL of 'gallery.json' on the National Geographic page
+    given by 'url' and 'text'
+    """
+
+    match = re.search(r'.*"endpoint":"([^"]*gallery\.json)".*', text)
+    return [match.group(1)]
+
+def parse_national_geographic_gallery(url, text):
+    """Returns the URLs of all images in the National Geographic
+    'gallery.json' given by 'url' and 'text'
+    """
+
+    image_data = json.loads(text)
+    return [item["image"]["uri"] for item in image_data["items"]]
+
+def parse_national_geographic_page(url, text):
+    """Returns the URL of the Photo Of The Day on the National Geographic
+    page given by 'url' and 'text'
+    """
+
+    match = re.search(r'.*content="([^"]*\.jpg)".*', text)
+    return [match.group(1)]
+
+def parse_bing_index(url, text):
+    """Returns the URL of Bing's Image Of The Day in the JSON given by
+    'url' and 'text'
+    """
+
+    image_data = json.loads(text)
+    image_url = image_data["images"][0]["url"]
+    image_url = image_url.split("&")[0]
+    return [urllib.parse.urljoin(url, image_url)]
+
+async def find_bing_archive_image_urls_async(month=None):
+    """Returns the URLs of all images of the month given by 'month' as
+    'YYYYMM', the current month if not given, of Bing Wallpaper Archive
+    """
+
+    logging.debug('find_bing_archive_image_urls_async(%s)', month)
+
+    if month is None:
+        month = datetime.datetime.now().strftime('%Y%m')
+    url = BING_ARCHIVE_URL.format(month)
+    return await fetch_parsed_async(url, parse_bing_archive_page, 'bingarchive')
+
+async def find_wikimedia_image_urls_async():
+    """Returns the URL of the latest image of Wikimedia Picture Of The Day"""
+
+    logging.debug('find_wikimedia_image_urls_async()')
+
+    return await fetch_parsed_async(WIKIMEDIA_URL, parse_wikimedia_page, 'wikimedia')
+
+async def find_flickr_image_urls_async():
+    """Returns the URL of the latest image of Peter Levi's Flickr Collection"""
+
+    logging.debug('find_flickr_image_urls_async()')
+
+    image_id = (await fetch_parsed_async(FLICKR_URL, parse_flickr_photostream, 'flickr'))[0]
+    return await fetch_parsed_async(FLICKR_URL+image_id+"/sizes/h/", parse_flickr_sizes_page, 'flickr')
+
+async def find_national_geographic_archive_image_urls_async():
+    """Returns the URLs of all images of National Geographics's Photo Of The Day Archive"""
+
+    logging.debug('find_national_geographic_archive_image_urls_async()')
+
+    gallery_json = (await fetch_parsed_async(NATIONAL_GEOGRAPHIC_URL, parse_national_geographic_endpoint,
+        'geographicarchive'))[0]
+    return await fetch_parsed_async(gallery_json, parse_national_geographic_gallery, 'geographicarchive')
+
+async def find_national_geographic_image_urls_async():
+    """Returns the URL of National Geographics's Photo Of The Day"""
+
+    logging.debug('find_national_geographic_image_urls_async()')
+
+    return await fetch_parsed_async(NATIONAL_GEOGRAPHIC_URL, parse_national_geographic_page, 'national')
+
+async def find_bing_image_urls_async():
+    """Returns the URL of Bing's Image Of The Day"""
+
+    logging.debug('find_bing_image_urls_async()')
+
+    return await fetch_parsed_async(BING_URL, parse_bing_index, 'bing')
+
+def get_a_bing_archive_wallpaper_remote():
+    """Retrieves the URL of one image of Bing Wallpaper Archive,
+    downloads the image, stores it in a temporary folder and returns the path
+    to it
+    """
+    
+    logging.debug('get_a_bing_archive_wallpaper_remote()')
+
+    full_image_urls = run_async(find_bing_archive_image_urls_async())
+    full_image_path = store_a_remote_image(full_image_urls, "bingarchive")
+
+    # Return full path to image
+    logging.debug('get_a_bing_archive_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_latest_wikimedia_wallpaper_remote():
+    """Retrieves the URL of the latest image of Wikimedia Picture Of The Day,
+    downloads the image, stores it in a temporary folder and returns the path
+    to it
+    """
+
+    logging.debug('get_latest_wikimedia_wallpaper_remote()')
+
+    full_image_url = run_async(find_wikimedia_image_urls_async())[0]
+    full_image_path = store_remote_image(full_image_url, "wikimedia")
+
+    # Return full path to image
+    logging.debug('get_latest_wikimedia_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_latest_flickr_wallpaper_remote():
+    """Retrieves the URL of the latest image of Peter Levi's Flickr Collection,
+    downloads the image, stores it in a temporary folder and returns the path
+    to it
+    """
+
+    logging.debug('get_latest_flickr_wallpaper_remote()')
+
+    full_image_url = run_async(find_flickr_image_urls_async())[0]
+    full_image_path = store_remote_image(full_image_url, "flickr")
+
+    # Return full path to image
+    logging.debug('get_latest_flickr_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_a_national_geographic_archive_wallpaper_remote():
+    """Retrieves a URL of National Geographics's Photo Of The Day Archive, downloads the image,
+    stores it in a temporary folder and returns the path to it
+    """
+
+    logging.debug('get_a_national_geographic_archive_wallpaper_remote()')
+
+    full_image_urls = run_async(find_national_geographic_archive_image_urls_async())
+    full_image_path = store_a_remote_image(full_image_urls, "nationalarchive")
+
+    # Return full path to image
+    logging.debug('get_a_national_geographic_archive_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_latest_national_geographic_wallpaper_remote():
+    """Retrieves the URL of National Geographics's Photo Of The Day, downloads the image,
+    stores it in a temporary folder and returns the path to it
+    """
+
+    logging.debug('get_latest_national_geographic_wallpaper_remote()')
+
+    full_image_url = run_async(find_national_geographic_image_urls_async())[0]
+    logging.debug('get_latest_national_geographic_wallpaper_remote - full_image_url = %s', full_image_url)
+    full_image_path = store_remote_image(full_image_url, "national")
+
+    # Return full path to image
+    logging.debug('get_latest_national_geographic_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+def get_latest_bing_wallpaper_remote():
+    """Retrieves the URL of Bing's Image Of The Day image, downloads the image,
+    stores it in a temporary folder and returns the path to it
+    """
+
+    logging.debug('get_latest_bing_wallpaper_remote()')
+
+    full_image_url = run_async(find_bing_image_urls_async())[0]
+    logging.debug('get_latest_bing_wallpaper_remote - full_image_url = %s', full_image_url)
+    full_image_path = store_remote_image(full_image_url, "bing")
+
+    # Return full path to image
+    logging.debug('get_latest_bing_wallpaper_remote - full_image_path = %s', full_image_path)
+    return full_image_path
+
+# All image sources by option name: short option and help of the command
+# line; function which returns the path of an image; for remote sources the
+# coroutine which finds the image URLs and the name in the database; cost
+# class; typical seconds to get an image; hours in which the source has
+# nothing new after a fetch. A new source only needs an entry here
+image_sources = {
+    'bingarchive': {'flag': '-a', 'help': "set Bing Wallpaper Archive as wallpaper",
+        'get': get_a_bing_archive_wallpaper_remote, 'find': find_bing_archive_image_urls_async,
+        'source': "bingarchive", 'cost': COST_ONE_REQUEST, 'latency': 1.5, 'freshness': 1},
+    'bing': {'flag': '-b', 'help': "set Bing Image Of The Day as wallpaper",
+        'get': get_latest_bing_wallpaper_remote, 'find': find_bing_image_urls_async,
+        'source': "bing", 'cost': COST_ONE_REQUEST, 'latency': 1.0, 'freshness': 24},
+    'flickr': {'flag': '-f', 'help': "set Peter Levi's Flickr Collection as wallpaper",
+        'get': get_latest_flickr_wallpaper_remote, 'find': find_flickr_image_urls_async,
+        'source': "flickr", 'cost': COST_MULTI_REQUEST, 'latency': 2.5, 'freshness': 24},
+    'geographicarchive': {'flag': '-g', 'help': "set National Geographic's Archive photo as wallpaper",
+        'get': get_a_national_geographic_archive_wallpaper_remote,
+        'find': find_national_geographic_archive_image_urls_async,
+        'source': "nationalarchive", 'cost': COST_MULTI_REQUEST, 'latency': 2.5, 'freshness': 1},
+    'national': {'flag': '-n', 'help': "set National Geographic's Photo Of The Day as wallpaper",
+        'get': get_latest_national_geographic_wallpaper_remote, 'find': find_national_geographic_image_urls_async,
+        'source': "national", 'cost': COST_ONE_REQUEST, 'latency': 1.5, 'freshness': 24},
+    'spotlight': {'flag': '-s', 'help': "set Microsoft Spotlight as wallpaper [default]",
+        'get': get_latest_wallpaper_local, 'find': None,
+        'source': "spotlight", 'cost': COST_LOCAL, 'latency': 0.05, 'freshness': 6},
+    'wikimedia': {'flag': '-w', 'help': "set Wikimedia Picture Of The Day as wallpaper",
+        'get': get_latest_wikimedia_wallpaper_remote, 'find': find_wikimedia_image_urls_async,
+        'source': "wikimedia", 'cost': COST_ONE_REQUEST, 'latency': 1.5, 'freshness': 24},
+}
+
+# Options which choose the source of the wallpaper, in the order they are
+# handled; --random comes before --wikimedia, as it always did
+source_options = list(image_sources)
+source_options.insert(source_options.index('wikimedia'), 'random')
+
+# Options besides the source options which need the database or the
+# network; runs with informational options only skip both. A new option
+# which does work is added here
+work_options = ('maintenance', 'daemon', 'harvest', 'prefetch', 'fit', 'fit_policy', 'fit_quality', 'deduplicate',
+    'cache_size', 'cache_images', 'cache_days', 'cache_policy', 'random_days', 'random_weight', 'stats')
+
+def is_option_given(args, option):
+    """Returns 'True' if the option given by 'option' is set in the parsed
+    command line 'args'; a number given as 0 counts as set
+    """
+
+    value = getattr(args, option)
+    return value is not None and value is not False
+
+def get_source_name(image_source):
+    """Returns the name of the source whose images are stored as
+    'image_source' in the database, which names the source in the metrics
+    """
+
+    for source_name, source in image_sources.items():
+        if source['source'] == image_source:
+            return source_name
+    return image_source
+
+def get_remote_sources():
+    """Returns the names of all sources which fetch their images from the
+    network, so they can be fetched ahead of time
+    """
+
+    return [source_name for source_name, source in image_sources.items() if source['find']]
+
+def get_source_fetch_times():
+    """Returns when each source was fetched last, as dict of seconds since
+    the epoch by source name, from database
+    """
+
+    logging.debug('get_source_fetch_times()')
+
+    return json.loads(get_setting_from_database('source_fetch_times', '{}'))
+
+def set_source_fetched(source_name):
+    """Stores the current time as the time the source given by
+    'source_name' was fetched last in database
+    """
+
+    logging.debug('set_source_fetched(%s)', source_name)
+
+    with database_transaction():
+        fetch_times = get_source_fetch_times()
+        fetch_times[source_name] = time.time()
+        set_setting_in_database('source_fetch_times', json.dumps(fetch_times))
+
+def get_stale_sources(source_names):
+    """Returns the sources of 'source_names' which were not fetched within
+    their freshness period, so they may have a new image
+    """
+
+    logging.debug('get_stale_sources(%s)', source_names)
+
+    fetch_times = get_source_fetch_times()
+    now = time.time()
+    return [source_name for source_name in source_names
+        if now - fetch_times.get(source_name, 0) >= image_sources[source_name]['freshness'] * 3600]
+
+def get_source_order(source_names):
+    """Returns the sources of 'source_names' in the order to try them: those
+    not fetched within their freshness period first, then the others. Within
+    both groups the order is random, but a source is the more likely early
+    the lower its cost class and latency are
+    """
+
+    logging.debug('get_source_order(%s)', source_names)
+
+    def weighted_shuffle(names):
+        # Weighted random order: each name draws random() ** (1 / weight)
+        return sorted(names, key=lambda name: random.random() ** (
+            (1 + image_sources[name]['cost']) * image_sources[name]['latency']), reverse=True)
+
+    stale_sources = get_stale_sources(source_names)
+    fresh_sources = [source_name for source_name in source_names if source_name not in stale_sources]
+    return weighted_shuffle(stale_sources) + weighted_shuffle(fresh_sources)
+
+def get_image_from_source(source_name):
+    """Returns the path of an image of the source given by 'source_name'.
+    Within its freshness period a remote source has nothing new, so its
+    latest cached image is returned without a request
+    """
+
+    logging.debug('get_image_from_source(%s)', source_name)
+
+    source = image_sources[source_name]
+    if source['find'] and not get_stale_sources([source_name]):
+        full_image_path = get_latest_image_of_source_from_database(source['source'])
+        if full_image_path:
+            return full_image_path
+    with metric_span('source', source_name):
+        full_image_path = source['get']()
+    if full_image_path:
+        set_source_fetched(source_name)
+    return full_image_path
+
+async def prefetch_wallpapers_async(source_names, max_workers, timeout):
+    """Fetches the sources given by 'source_names' on one event loop, so the
+    requests of different sources overlap, and returns the summary described
+    in prefetch_wallpapers()
+    """
+
+    logging.debug('prefetch_wallpapers_async(%s, %s, %s)', source_names, max_workers, timeout)
+
+    import asyncio
+    import concurrent.futures
+
+    # Blocking requests, downloads and database access run in this pool. It is
+    # not the default executor, which asyncio.run() waits for at the end
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    loop_executors[asyncio.get_running_loop()] = executor
+
+    async def fetch(source_name):
+        find_image_urls, image_source = image_sources[source_name]['find'], image_sources[source_name]['source']
+        start = time.perf_counter()
+        try:
+            full_image_urls = await asyncio.wait_for(find_image_urls(), timeout)
+            full_image_path = await asyncio.wait_for(store_a_remote_image_async(full_image_urls, image_source),
+                max(0, start + timeout - time.perf_counter()))
+            result = {'status': 'fetched', 'seconds': time.perf_counter() - start, 'path': full_image_path}
+            set_source_fetched(source_name)
+        except asyncio.TimeoutError:
+            result = {'status': 'timeout', 'seconds': timeout, 'path': None}
+        except Exception as e:
+            result = {'status': 'failed', 'seconds': None, 'path': None, 'error': repr(e)}
+        logging.debug('prefetch_wallpapers_async - %s = %s', source_name, result)
+        add_metric_span('source', source_name, result['status'] == 'fetched', time.perf_counter() - start)
+        return source_name, result
+
+    try:
+        results = await asyncio.gather(*[fetch(source_name) for source_name in source_names])
+    finally:
+        # Work of a source which timed out is left behind; its request ends
+        # on its own within the HTTP timeouts
+        executor.shutdown(wait=False, cancel_futures=True)
+    return dict(results)
+
+def prefetch_wallpapers(source_names=None, max_workers=4, timeout=60):
+    """Fetches the latest image of all remote sources given by 'source_names'
+    at the same time and stores them in the image folder and database.
+    Blocking work runs in a pool of at most 'max_workers' threads. A source
+    not done within 'timeout' seconds is reported as timed out and not waited
+    for; the request it is running ends on its own within HTTP_CONNECT_TIMEOUT
+    and HTTP_READ_TIMEOUT, which apply to each request. A source fetched
+    within its freshness period has nothing new and is reported as 'fresh'
+    with its latest cached image. Returns a dict with status, duration and
+    path or error per source
+    """
+
+    logging.debug('prefetch_wallpapers(%s, %s, %s)', source_names, max_workers, timeout)
+
+    if source_names is None:
+        source_names = get_remote_sources()
+    stale_sources = get_stale_sources(source_names)
+    summary = {}
+    if stale_sources:
+        summary = run_async(prefetch_wallpapers_async(stale_sources, max_workers, timeout))
+    for source_name in source_names:
+        if source_name not in summary:
+            summary[source_name] = {'status': 'fresh', 'seconds': None,
+                'path': get_latest_image_of_source_from_database(image_sources[source_name]['source']) or None}
+    return {source_name: summary[source_name] for source_name in source_names}
+
+def print_prefetch_summary(summary):
+    """Prints one line per source of the summary given by 'summary'"""
+
+    logging.debug('print_prefetch_summary()')
+
+    for source_name, result in summary.items():
+        seconds = '{:.2f} s'.format(result['seconds']) if result['seconds'] is not None else '-'
+        print('{:<20} {:<8} {:>9}  {}'.format(source_name, result['status'], seconds,
+            result['path'] or result.get('error', '')))
+    fetched = len([result for result in summary.values() if result['status'] == 'fetched'])
+    fresh = len([result for result in summary.values() if result['status'] == 'fresh'])
+    print('{} of {} sources fetched, {} fresh'.format(fetched, len(summary), fresh))
+
+def get_archive_months(first_month, last_month):
+    """Returns all months from 'first_month' to 'last_month', both as
+    'YYYYMM', in this order
+    """
+
+    year, month = int(first_month[:4]), int(first_month[4:])
+    last = int(last_month[:4]), int(last_month[4:])
+    months = []
+    while (year, month) <= last:
+        months.append('{:04d}{:02d}'.format(year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def parse_harvest_months(text):
+    """Checks the months given by '--harvest' as 'YYYYMM' or
+    'YYYYMM-YYYYMM' and returns first and last month, the last as 'None' if
+    not given
+    """
+
+    first_month, _, last_month = text.partition('-')
+    for month in filter(None, [first_month, last_month]):
+        try:
+            if len(month) != 6:
+                raise ValueError(month)
+            datetime.datetime.strptime(month, '%Y%m')
+        except ValueError:
+            raise argparse.ArgumentTypeError("expected months as 'YYYYMM' or 'YYYYMM-YYYYMM', got '{}'".format(text))
+    return first_month, last_month or None
+
+async def harvest_images_async(full_image_urls, image_source, budget):
+    """Downloads all images of 'full_image_urls' which are not in the
+    database at the same time, limited per host like all requests, until the
+    byte and rate limits of 'budget' are reached. Updates the counters in
+    'budget' and returns 'True' if every missing image was stored
+    """
+
+    logging.debug('harvest_images_async(%s urls, %s)', len(full_image_urls), image_source)
+
+    import asyncio
+
+    async def harvest_image(full_image_url):
+        async with get_host_semaphore(full_image_url):
+            if budget['max_bytes'] and budget['bytes'] >= budget['max_bytes']:
+                budget['exhausted'] = True
+                return False
+            if budget['rate']:
+                # Wait until the bytes so far fit into the rate
+                await asyncio.sleep(budget['bytes'] / budget['rate'] - (time.monotonic() - budget['start']))
+            try:
+                full_image_path = await run_blocking_async(store_remote_image, full_image_url, image_source)
+            except Exception as error:
+                logging.debug('harvest_images_async - %s failed: %s', full_image_url, error)
+                budget['failed'] += 1
+                return False
+            budget['bytes'] += os.path.getsize(full_image_path)
+            budget['stored'] += 1
+            return True
+
+    missing_urls = get_missing_images_from_database(full_image_urls)
+    budget['found'] += len(full_image_urls)
+    results = await asyncio.gather(*[harvest_image(full_image_url) for full_image_url in missing_urls])
+    return all(results)
+
+async def harvest_archives_async(months, budget):
+    """Harvests the Bing Wallpaper Archive months given by 'months' and the
+    National Geographic gallery. Months done before, as stored in the
+    database, are skipped; every month which is over and whose images are
+    all stored is stored as done. The current month may still get images
+    """
+
+    logging.debug('harvest_archives_async(%s months)', len(months))
+
+    current_month = datetime.datetime.now().strftime('%Y%m')
+    done_months = set(json.loads(get_setting_from_database('harvest_done_months', '[]')))
+    for month in months:
+        if month in done_months:
+            budget['skipped'] += 1
+            continue
+        if budget['exhausted']:
+            break
+        try:
+            full_image_urls = await find_bing_archive_image_urls_async(month)
+        except Exception as error:
+            logging.debug('harvest_archives_async - month %s failed: %s', month, error)
+            budget['failed'] += 1
+            continue
+        if await harvest_images_async(full_image_urls, "bingarchive", budget) and month < current_month:
+            done_months.add(month)
+            # Checkpoint, a later harvest continues from here
+            set_setting_in_database('harvest_done_months', json.dumps(sorted(done_months)))
+        budget['months'] += 1
+    if not budget['exhausted']:
+        try:
+            full_image_urls = await find_national_geographic_archive_image_urls_async()
+        except Exception as error:
+            logging.debug('harvest_archives_async - gallery failed: %s', error)
+            budget['failed'] += 1
+        else:
+            await harvest_images_async(full_image_urls, "nationalarchive", budget)
+
+def harvest_archives(first_month, last_month=None, max_bytes=None, rate=0):
+    """Downloads all images of the Bing Wallpaper Archive from 'first_month'
+    to 'last_month', the current month if not given, both as 'YYYYMM', and
+    of the National Geographic gallery which are not cached yet. Stops after
+    'max_bytes' bytes, the space left in the cache if not given, and keeps
+    below 'rate' bytes per second if given. Returns a dict of counters
+    """
+
+    logging.debug('harvest_archives(%s, %s, %s, %s)', first_month, last_month, max_bytes, rate)
+
+    last_month = last_month or datetime.datetime.now().strftime('%Y%m')
+    if max_bytes is None:
+        cache_max_bytes = get_cache_limits()[0]
+        max_bytes = max(1, cache_max_bytes - get_cache_size_from_database()[1]) if cache_max_bytes else 0
+    budget = {'max_bytes': max_bytes, 'rate': rate, 'start': time.monotonic(), 'bytes': 0, 'months': 0,
+        'skipped': 0, 'found': 0, 'stored': 0, 'failed': 0, 'exhausted': False}
+    run_async(harvest_archives_async(get_archive_months(first_month, last_month), budget))
+    budget['seconds'] = time.monotonic() - budget['start']
+    return budget
+
+def print_harvest_summary(budget):
+    """Prints the counters of a harvest given by 'budget'"""
+
+    logging.debug('print_harvest_summary()')
+
+    print('{} months harvested, {} done before, {} images found, {} stored with {:.1f} MB in {:.1f} s, {} failed'.format(
+        budget['months'], budget['skipped'], budget['found'], budget['stored'], budget['bytes'] / MEGABYTE,
+        budget['seconds'], budget['failed']))
+    if budget['exhausted']:
+        print('stopped at the limit of {:.1f} MB, harvest again to continue'.format(budget['max_bytes'] / MEGABYTE))
+
+def get_wallpaper_for_options(args):
+    """Fetches an image from every source chosen in the parsed command line
+    'args' and returns the path of the last one, or of the latest Spotlight
+    image if no source is chosen
+    """
+
+    logging.debug('get_wallpaper_for_options()')
+
+    path = ""
+    for option in source_options:
+        if getattr(args, option):
+            path = get_random_image() if option == 'random' else get_image_from_source(option)
+    if not any(getattr(args, option) for option in source_options):
+        # default
+        path = get_latest_wallpaper_local()
+    return path
+
+def show_wallpaper(path):
+    """Sets the image given by 'path' as wallpaper and remembers that it was
+    shown
+    """
+
+    logging.debug('show_wallpaper(%s)', path)
+
+    set_wallpaper(get_fitted_image(path))
+    add_recent_wallpaper(path)
+    record_wallpaper_shown(path)
+
+def fit_image(full_image_path, fitted_image_path, width, height, policy, quality):
+    """Scales the image given by 'full_image_path' to 'width' x 'height'
+    pixel, cropping what sticks out for the policy 'fill' and keeping all of
+    it for 'fit', and writes it as JPEG of 'quality' to 'fitted_image_path'.
+    Returns 'fitted_image_path' or 'None' if Pillow is not installed or the
+    image cannot be decoded. Runs in worker processes as well
+    """
+
+    logging.debug('fit_image(%s, %s, %s, %s, %s)', full_image_path, width, height, policy, quality)
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        with Image.open(full_image_path) as image:
+            # Let the JPEG decoder scale down while decoding
+            image.draft('RGB', (width, height))
+            image = image.convert('RGB')
+            if policy == 'fill':
+                image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+            else:
+                image.thumbnail((width, height), Image.LANCZOS)
+            os.makedirs(os.path.dirname(fitted_image_path), exist_ok=True)
+            image.save(fitted_image_path + '.part', 'JPEG', quality=quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logging.debug('fit_image - cannot fit %s', full_image_path)
+        return None
+    os.replace(fitted_image_path + '.part', fitted_image_path)
+    return fitted_image_path
+
+def get_fit_settings():
+    """Returns the fit policy and the JPEG quality of the screen-fitted
+    copies from database
+    """
+
+    logging.debug('get_fit_settings()')
+
+    return (get_setting_from_database('fit_policy', FIT_POLICY),
+        int(get_setting_from_database('fit_quality', FIT_QUALITY)))
+
+def needs_fitting(full_image_path, width, height):
+    """Returns 'True' if the image given by 'full_image_path' is larger than
+    'width' x 'height' pixel, so a screen-fitted copy saves decoding and
+    scaling at every set
+    """
+
+    try:
+        _, image_width, image_height = read_image_header(full_image_path)
+    except OSError:
+        return False
+    return bool(image_width and image_height) and (image_width > width or image_height > height)
+
+def get_fitted_image(full_image_path, resolution=None):
+    """Returns the path of the copy of the image given by 'full_image_path'
+    fitted to 'resolution', the primary screen if not given, and creates
+    it once. Returns 'full_image_path' if fitting is off, brings nothing or
+    fails
+    """
+
+    logging.debug('get_fitted_image(%s, %s)', full_image_path, resolution)
+
+    policy, quality = get_fit_settings()
+    if policy == 'off':
+        return full_image_path
+    width, height = resolution or (get_screen_width(), get_screen_height())
+    fitted_image_path = get_fitted_image_path(full_image_path, width, height, policy, quality)
+    with contextlib.suppress(OSError):
+        if os.path.getmtime(fitted_image_path) >= os.path.getmtime(full_image_path):
+            return fitted_image_path
+    if not needs_fitting(full_image_path, width, height):
+        return full_image_path
+    return fit_image(full_image_path, fitted_image_path, width, height, policy, quality) or full_image_path
+
+def fit_cached_images(resolutions=None, max_workers=None):
+    """Creates the missing screen-fitted copies of all cached images for all
+    screens given by 'resolutions', every monitor if not given, in a pool of
+    'max_workers' processes, one per CPU if not given. Returns the number of
+    copies created
+    """
+
+    logging.debug('fit_cached_images(%s, %s)', resolutions, max_workers)
+
+    import concurrent.futures
+
+    policy, quality = get_fit_settings()
+    if policy == 'off':
+        return 0
+    resolutions = resolutions or get_screen_resolutions()
+    with database_transaction() as conn:
+        paths = [row[0] for row in conn.execute("SELECT DISTINCT ipath FROM wallpapers WHERE ipath IS NOT NULL")]
+    tasks = []
+    for full_image_path in paths:
+        for width, height in resolutions:
+            fitted_image_path = get_fitted_image_path(full_image_path, width, height, policy, quality)
+            if not os.path.isfile(fitted_image_path) and needs_fitting(full_image_path, width, height):
+                tasks.append((full_image_path, fitted_image_path, width, height, policy, quality))
+    if not tasks:
+        return 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(fit_image, *zip(*tasks), chunksize=4))
+    created = len([result for result in results if result])
+    logging.debug('fit_cached_images - %s of %s copies created', created, len(tasks))
+    return created
+
+def get_queue_key(args):
+    """Returns the name of the queue for the source options chosen in the
+    parsed command line 'args', or 'None' if they need no queue because
+    they only read the local Spotlight assets
+    """
+
+    logging.debug('get_queue_key()')
+
+    chosen_options = [option for option in source_options if getattr(args, option)]
+    if not [option for option in chosen_options if option != 'spotlight']:
+        return None
+    return ','.join(chosen_options)
+
+def is_valid_image(full_image_path):
+    """Returns 'True' if the file given by 'full_image_path' exists and
+    starts like an image with known dimensions
+    """
+
+    logging.debug('is_valid_image(%s)', full_image_path)
+
+    try:
+        _, width, height = read_image_header(full_image_path)
+    except OSError:
+        return False
+    return bool(width and height)
+
+def pop_wallpaper_from_queue(queue_key):
+    """Removes the images from the head of the queue given by 'queue_key'
+    until one is still a valid image and returns its path, or "" if the
+    queue has none. Reads only the database and the image header
+    """
+
+    logging.debug('pop_wallpaper_from_queue(%s)', queue_key)
+
+    with database_transaction():
+        for queue_id, full_image_path in get_wallpaper_queue_from_database(queue_key):
+            delete_wallpaper_from_queue_in_database(queue_id)
+            if is_valid_image(full_image_path):
+                return full_image_path
+    return ""
+
+def refill_wallpaper_queue(args, length=QUEUE_LENGTH, current_path=""):
+    """Fetches images from the sources chosen in the parsed command line
+    'args' until their queue holds 'length' valid images. A source which
+    returns an image already queued or the current wallpaper given by
+    'current_path' has nothing new, so only --random tries further. Returns
+    the number of images added
+    """
+
+    logging.debug('refill_wallpaper_queue(%s, %s)', length, current_path)
+
+    queue_key = get_queue_key(args)
+    if queue_key is None:
+        return 0
+    queued_paths = set(full_image_path for _, full_image_path in get_wallpaper_queue_from_database(queue_key))
+    queued = len(queued_paths)
+    if current_path:
+        queued_paths.add(current_path)
+    added = 0
+    for _ in range(2 * (length - queued)):
+        if queued >= length:
+            break
+        full_image_path = get_wallpaper_for_options(args)
+        if not full_image_path or full_image_path in queued_paths or not is_valid_image(full_image_path):
+            if args.random:
+                continue
+            break
+        add_wallpaper_to_queue_in_database(queue_key, full_image_path)
+        # Setting it later needs no decoding then
+        get_fitted_image(full_image_path)
+        queued_paths.add(full_image_path)
+        queued += 1
+        added += 1
+    logging.debug('refill_wallpaper_queue - %s images added', added)
+    return added
+
+def show_next_wallpaper(args, refill=True):
+    """Sets the head of the queue of the source options chosen in the parsed
+    command line 'args' as wallpaper, without waiting for the network. Only
+    an empty queue makes it fetch the image first. Refills the queue
+    afterwards if 'refill' is set. Returns the path of the wallpaper
+    """
+
+    logging.debug('show_next_wallpaper(%s)', refill)
+
+    queue_key = get_queue_key(args)
+    path = ""
+    if queue_key is not None:
+        path = pop_wallpaper_from_queue(queue_key)
+    if not path:
+        path = get_wallpaper_for_options(args)
+    if path:
+        show_wallpaper(path)
+    if refill:
+        refill_wallpaper_queue(args, current_path=path)
+    return path
+
+def get_kept_paths(path):
+    """Returns the paths the cache eviction must keep: the current wallpaper
+    given by 'path' and all queued images
+    """
+
+    logging.debug('get_kept_paths(%s)', path)
+
+    return [full_image_path for _, full_image_path in get_wallpaper_queue_from_database()] + ([path] if path else [])
+
+def run_daemon(args, interval, prefetch_lead=DAEMON_PREFETCH_LEAD, rotations=None, sleep=time.sleep):
+    """Sets a new wallpaper from the sources chosen in the parsed command
+    line 'args' every 'interval' seconds, 'rotations' times or until
+    interrupted. The remote sources among them are fetched 'prefetch_lead'
+    seconds before each change, so the change finds the images in the cache.
+    Database, HTTP session and caches stay open between the changes.
+    Returns the number of changes
+    """
+
+    logging.debug('run_daemon(%s, %s, %s)', interval, prefetch_lead, rotations)
+
+    prefetch_sources = [name for name in get_remote_sources() if args.random or getattr(args, name)]
+    queue_key = get_queue_key(args)
+    prefetch_lead = min(prefetch_lead, interval / 2)
+    scheduler = sched.scheduler(time.monotonic, sleep)
+    state = {'rotations': 0, 'next': time.monotonic(), 'path': ""}
+
+    def rotate():
+        path = ""
+        try:
+            path = show_next_wallpaper(args, refill=False)
+            state['path'] = path
+            with metric_span('maintenance', 'incremental'):
+                database_maintenance_incremental()
+            with metric_span('maintenance', 'eviction'):
+                evict_images(*get_cache_limits(), keep_paths=get_kept_paths(path))
+            save_metrics()
+        except Exception:
+            # A failing source must not end the daemon
+            logging.exception('run_daemon - rotation failed')
+        state['rotations'] += 1
+        if rotations is not None and state['rotations'] >= rotations:
+            return
+        # Fixed steps from the start, so slow changes do not shift the schedule
+        state['next'] = max(state['next'] + interval, time.monotonic())
+        scheduler.enterabs(state['next'], 1, rotate)
+        if prefetch_sources or queue_key is not None:
+            scheduler.enterabs(state['next'] - prefetch_lead, 0, prefetch)
+
+    def prefetch():
+        try:
+            if prefetch_sources:
+                prefetch_wallpapers(prefetch_sources)
+            refill_wallpaper_queue(args, current_path=state['path'])
+        except Exception:
+            logging.exception('run_daemon - prefetch failed')
+
+    scheduler.enter(0, 1, rotate)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logging.debug('run_daemon - interrupted')
+    return state['rotations']
+
+def start_profiling(fname, top):
+    """Profiles the rest of the run with cProfile. At exit the statistics
+    are written in pstats format to 'fname', which snakeviz, gprof2dot or
+    flameprof turn into call graphs and flame graphs, and the 'top'
+    functions with the most cumulative and own time are printed. Work in
+    the thread and process pools shows up as waiting in the main thread
+    """
+
+    logging.debug('start_profiling(%s, %s)', fname, top)
+
+    import atexit
+    import cProfile
+
+    profiler = cProfile.Profile()
+    atexit.register(write_profile, profiler, fname, top)
+    profiler.enable()
+    return profiler
+
+def write_profile(profiler, fname, top):
+    """Stops 'profiler', writes its statistics to 'fname' and prints the
+    'top' functions sorted by cumulative and by own time
+    """
+
+    import pstats
+
+    profiler.disable()
+    logging.debug('write_profile(%s, %s)', fname, top)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    profiler.dump_stats(fname)
+    stats = pstats.Stats(profiler, stream=sys.stdout)
+    stats.strip_dirs()
+    for sort_key in ['cumulative', 'tottime']:
+        print('Top {} functions by {} time'.format(top, 'own' if sort_key == 'tottime' else sort_key))
+        stats.sort_stats(sort_key).print_stats(top)
+    print('Profile written to {}'.format(fname))
+
+def usage(arg):
+    """Shows help of this tool"""
+
+    logging.debug('usage(%s)', arg)
+
+    myDocstring = ""
+    if arg in ["-i", "--info"]:
+        myDocstring = myDocstring+"\n"+__doc__
+        myDocstring = myDocstring+"\n    AUTHOR\n\n        $author$\n"
+        myDocstring = myDocstring+"\n    LICENSE\n\n        $license$\n"
         parser.print_help()
     elif arg in ["-v", "-i", "--version", "--info"]:
         myDocstring = myDocstring+"\n    VERSION\n\n        $version$\n"    
@@ -722,21 +2943,35 @@ def usage(arg):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Load and show nice Windows background images.')
-    parser.add_argument('-a', '--bingarchive', help = "set Bing Wallpaper Archive as wallpaper", action="store_true")
-    parser.add_argument('-b', '--bing', help = "set Bing Image Of The Day as wallpaper", action="store_true")
-    parser.add_argument('-f', '--flickr', help = "set Peter Levi's Flickr Collection as wallpaper", action="store_true")
-    parser.add_argument('-g', '--geographicarchive', help = "set National Geographic's Archive photo as wallpaper", action="store_true")
-    parser.add_argument('-n', '--national', help = "set National Geographic's Photo Of The Day as wallpaper", action="store_true")
-    parser.add_argument('-s', '--spotlight', help = "set Microsoft Spotlight as wallpaper [default]", action="store_true")
-    parser.add_argument('-w', '--wikimedia', help = "set Wikimedia Picture Of The Day as wallpaper", action="store_true")
+    for source_name, source in image_sources.items():
+        parser.add_argument(source['flag'], '--' + source_name, help = source['help'], action="store_true")
     parser.add_argument('-r', '--random', help = "set wallpaper from random source", action="store_true")
     parser.add_argument('-p','--proxy', help = "use proxy to grab images", action="store_true")
     parser.add_argument('-i','--info', help = "show license and author information", action="store_true")
     parser.add_argument('-v', '--version', help = "show version", action="store_true")
     parser.add_argument('-d','--debug', help = "write debug output to logfile", action="store_true")
+    parser.add_argument('--deduplicate', help = "store images with equal content only once, show the disk space reclaimed and compute the missing perceptual hashes", action="store_true")
+    parser.add_argument('--prefetch', help = "fetch all remote sources at the same time into the local cache", action="store_true")
+    parser.add_argument('--cache-size', help = "limit the image cache to this many MB, 0 for no limit [default: 1024]", type=float, metavar='MB')
+    parser.add_argument('--cache-images', help = "limit the image cache to this many images, 0 for no limit [default: 0]", type=int, metavar='N')
+    parser.add_argument('--cache-days', help = "delete cached images not used for this many days, 0 for no limit [default: 0]", type=float, metavar='DAYS')
+    parser.add_argument('--cache-policy', help = "evict least recently ('lru') [default] or least often ('lfu') shown images first", choices=sorted(eviction_policies))
+    parser.add_argument('--random-days', help = "do not show an image again with --random within this many days [default: {}]".format(RANDOM_REPEAT_DAYS), type=float, metavar='DAYS')
+    parser.add_argument('--random-weight', help = "pick images of SOURCE this many times as often with --random, 1 for as often as the others [default: 1]; may be given several times", type=parse_source_weight, action='append', metavar='SOURCE=WEIGHT')
+    parser.add_argument('--fit', help = "create screen-fitted copies of all cached images for all monitors", action="store_true")
+    parser.add_argument('--fit-policy', help = "set screen-fitted copies which are cropped ('fill') [default] or show all of the image ('fit'), or the originals ('off')", choices=fit_policies)
+    parser.add_argument('--fit-quality', help = "JPEG quality of the screen-fitted copies [default: {}]".format(FIT_QUALITY), type=int, choices=range(1, 96), metavar='1-95')
+    parser.add_argument('--harvest', help = "download all images of the Bing Wallpaper Archive from month FIRST to month LAST [default: this month] and of the National Geographic gallery", type=parse_harvest_months, metavar='FIRST[-LAST]')
+    parser.add_argument('--harvest-limit', help = "stop harvesting after this many MB [default: space left in the cache]", type=float, metavar='MB')
+    parser.add_argument('--harvest-rate', help = "harvest with at most this many KB per second [default: no limit]", type=float, default=0, metavar='KB')
+    parser.add_argument('--daemon', help = "keep running and set a new wallpaper from the chosen source every interval", action="store_true")
+    parser.add_argument('--interval', help = "minutes between two wallpapers in daemon mode [default: {}]".format(DAEMON_INTERVAL_MINUTES), type=float, default=DAEMON_INTERVAL_MINUTES, metavar='MINUTES')
+    parser.add_argument('--setter', help = "how to set the wallpaper; 'headless' only logs it [default: windows]", choices=sorted(wallpaper_setters), default=wallpaper_setter)
+    parser.add_argument('--stats', help = "show success rate, median and 95th percentile seconds and MB transferred per kind of work and source of the last {} days, as table with the hit rate of the HTTP cache [default] or CSV".format(METRICS_MAX_DAYS), nargs='?', const='table', choices=['table', 'csv'])
+    parser.add_argument('--profile', help = "profile this run, write the statistics to a pstats file next to the debug logfile and show the N slowest functions [default: 20]", nargs='?', const=20, type=int, metavar='N')
+    parser.add_argument('-m','--maintenance', help = "sync database and image folder; 'incremental' checks a bounded slice per run [default], 'full' checks everything", choices=['incremental', 'full'])
     path = ""
     args = parser.parse_args()
-    use_proxy = False
     set_any_option = False
     if args.debug:
         myname = os.path.basename(__file__).split('.')[0]
@@ -748,47 +2983,93 @@ if __name__ == "__main__":
         for arg in vars(args):
             if getattr(args, arg):
                 myargs.append('--{}'.format(arg))
-        logging.debug('__main__ - Starting application with "{}.py {}"'.format(myname,' '.join(myargs)))
+        logging.debug('__main__ - Starting application with "%s.py %s"', myname,' '.join(myargs))
+    if args.profile:
+        myname = os.path.basename(__file__).split('.')[0]
+        mypath = os.path.join(os.environ['LOCALAPPDATA'],'WarietyWallpaperImages')
+        start_profiling(os.path.join(mypath, '{}.pstats'.format(myname)), args.profile)
     if args.proxy:
         set_proxy_with_environment_variable()
         use_proxy = True
-    # Initialize database
-    initialization()
-    # do maintenance in any case; do it only after debug
-    database_maintenance()
+    wallpaper_setter = args.setter
     if args.info:
         usage('-i')
         set_any_option = True
     if args.version:
         usage('-v')
         set_any_option = True
-    if args.bingarchive:
-        path = get_a_bing_archive_wallpaper_remote()
+    if set_any_option and not any(is_option_given(args, option) for option in (*source_options, *work_options)):
+        # Fast path: informational options need neither database nor network
+        logging.debug('__main__ - Stopping application with exit code "0"\n')
+        sys.exit(0)
+    # Initialize database
+    initialization()
+    # do maintenance in any case; do it only after debug
+    with metric_span('maintenance', args.maintenance or 'incremental'):
+        if args.maintenance == 'full':
+            database_maintenance()
+        else:
+            database_maintenance_incremental()
+    if args.maintenance:
         set_any_option = True
-    if args.bing:
-        path = get_latest_bing_wallpaper_remote()
+    # Cache limits are kept for later runs
+    if args.cache_size is not None:
+        set_setting_in_database('cache_max_bytes', int(args.cache_size * MEGABYTE))
+    if args.cache_images is not None:
+        set_setting_in_database('cache_max_images', args.cache_images)
+    if args.cache_days is not None:
+        set_setting_in_database('cache_max_days', args.cache_days)
+    if args.cache_policy:
+        set_setting_in_database('cache_eviction_policy', args.cache_policy)
+    if (args.cache_size is not None or args.cache_images is not None or args.cache_days is not None
+        or args.cache_policy):
         set_any_option = True
-    if args.flickr:
-        path = get_latest_flickr_wallpaper_remote()
+    # Settings of --random are kept for later runs
+    if args.random_days is not None:
+        set_setting_in_database('random_repeat_days', args.random_days)
         set_any_option = True
-    if args.geographicarchive:
-        path = get_a_national_geographic_archive_wallpaper_remote()
+    if args.random_weight:
+        source_weights = get_random_settings()[1]
+        source_weights.update(args.random_weight)
+        set_setting_in_database('random_source_weights', json.dumps(source_weights))
         set_any_option = True
-    if args.national:
-        path = get_latest_national_geographic_wallpaper_remote()
+    if args.fit_policy:
+        set_setting_in_database('fit_policy', args.fit_policy)
         set_any_option = True
-    if args.spotlight:
-        path = get_latest_wallpaper_local()
+    if args.fit_quality:
+        set_setting_in_database('fit_quality', args.fit_quality)
         set_any_option = True
-    if args.random:
-        path = get_random_image()
+    if args.prefetch:
+        print_prefetch_summary(prefetch_wallpapers())
         set_any_option = True
-    if args.wikimedia:
-        path = get_latest_wikimedia_wallpaper_remote()
+    if args.harvest:
+        first_month, last_month = args.harvest
+        max_bytes = None if args.harvest_limit is None else int(args.harvest_limit * MEGABYTE)
+        print_harvest_summary(harvest_archives(first_month, last_month, max_bytes, args.harvest_rate * KILOBYTE))
         set_any_option = True
-    if not set_any_option:
-        # default
-        path = get_latest_wallpaper_local()
-    set_wallpaper_with_ctypes(path)
+    if args.fit:
+        print('{} screen-fitted images created'.format(fit_cached_images()))
+        set_any_option = True
+    if args.deduplicate:
+        deleted_files, reclaimed_bytes = deduplicate_images()
+        print('{} duplicate images deleted, {:.1f} MB reclaimed'.format(deleted_files, reclaimed_bytes / MEGABYTE))
+        print('{} perceptual hashes computed'.format(update_perceptual_hashes()))
+        set_any_option = True
+    if args.stats:
+        set_any_option = True
+    if args.daemon:
+        run_daemon(args, args.interval * 60)
+    elif not set_any_option or any(getattr(args, option) for option in source_options):
+        path = show_next_wallpaper(args)
+    with metric_span('maintenance', 'eviction'):
+        evict_images(*get_cache_limits(), keep_paths=get_kept_paths(path))
+    save_metrics()
+    if args.stats:
+        print_metrics(get_metrics_from_database(), args.stats)
+        if args.stats == 'table':
+            # CSV output stays one table
+            print_http_cache_statistics(get_http_cache_statistics())
+    close_http_session()
+    close_database_connection()
     logging.debug('__main__ - Stopping application with exit code "0"\n')
-    sys.exit(0)
\ No newline at end of file
+    sys.exit(0)
\ No newline at end of file